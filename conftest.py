@@ -0,0 +1 @@
+#conftest à la racine : pytest ajoute ce dossier à sys.path, le paquet prafa est importable sans installation
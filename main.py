@@ -3,8 +3,10 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import pandas as pd
 import os
+import re
 from prafa.portfolio import Portfolio
 from prafa.universe import Universe
+from prafa.replicator_runner import compile_progress_pattern
 
 
 def Main():
@@ -21,14 +23,101 @@ def Main():
     parser.add_argument('--replicator_cores', type=int, default=8,
                     help='Number of OpenMP threads for ReplicaTOR (num_cores_per_controller)')
 
+    parser.add_argument('--gurobi_threads', type=int, default=0,
+                    help='Threads parameter for Gurobi (0 lets Gurobi decide)')
+
+    parser.add_argument('--workers', type=int, default=1,
+                    help='Number of processes solving rebalancing windows in parallel; the cores are split between them')
+
     parser.add_argument('--time_limit', type=float, default=300,
                     help='Time limit in seconds for solver runs')
 
     parser.add_argument('--distance_method', type=str, choices=['dcor', 'pearson'], default='pearson',
                     help='Distance metric to build correlation matrix')
 
+    parser.add_argument('--dcor_engine', type=str, choices=['blas', 'fast'], default='blas',
+                    help="All-pairs dcor engine: 'blas' (tiled matrix products) or 'fast' (O(T log T) kernel, memory stays flat)")
+
+    parser.add_argument('--dcor_workers', type=int, default=1,
+                    help="Processes used by --dcor_engine fast")
+
+    parser.add_argument('--rolling_covariance', action='store_true',
+                    help='Assemble Pearson correlations from running X^T X totals moved by the rows entering and leaving each window, when cheaper than np.corrcoef')
+
+    parser.add_argument('--distance_cache', type=str, default=None,
+                    help='Directory caching distance matrices across runs (disabled if omitted)')
+
+    parser.add_argument('--distance_cache_gb', type=float, default=10.0,
+                    help='Disk budget of --distance_cache in GiB; least recently used matrices are evicted beyond it')
+
+    parser.add_argument('--dist_format', type=str, default='text', choices=['text', 'binary'],
+                    help='Format of the distance matrix file written by QUOB (binary is only read by --quob_backend numpy)')
+
+    parser.add_argument('--adjacency', type=str, default='complete', choices=['complete', 'knn'],
+                    help='Graph handed to ReplicaTOR: complete (cached dense file) or knn (dense 0/1 matrix of the k-nearest-neighbour graph)')
+
+    parser.add_argument('--adjacency_k', type=int, default=20,
+                    help='Neighbours per stock with --adjacency knn')
+
+    parser.add_argument('--workdir_root', type=str, default=None,
+                    help='Root of the per-solve ReplicaTOR working directories, e.g. /dev/shm (default: prafa/dist_matrix)')
+
+    parser.add_argument('--keep_artifacts', action='store_true',
+                    help='Keep each solve\'s ReplicaTOR working directory instead of deleting it')
+
+    parser.add_argument('--replicator_scheduler', action='store_true',
+                    help='Run --workers QUOB windows in threads sharing one core-aware ReplicaTOR scheduler')
+
+    parser.add_argument('--cost_trace_dir', type=str, default=None,
+                    help='Directory for one ReplicaTOR best-cost trace CSV per window (default: inside the solve directory)')
+
+    parser.add_argument('--stall_seconds', type=float, default=None,
+                    help='Stop ReplicaTOR when its best cost has not improved for this many seconds')
+
+    parser.add_argument('--stall_rounds', type=int, default=None,
+                    help='Stop ReplicaTOR when its best cost has not improved for this many rounds')
+
+    parser.add_argument('--stall_grace', type=float, default=10.0,
+                    help='Seconds ReplicaTOR gets to report its incumbent after SIGINT before it is killed')
+
+    parser.add_argument('--cost_pattern', type=str, default=None,
+                    help='Regular expression of ReplicaTOR progress lines, with a (?P<cost>...) group and an optional (?P<round>...) group (default: "round <N> best cost: <X>")')
+
+    parser.add_argument('--warm_start', type=str, default='none', choices=['none', 'seed', 'only'],
+                    help='Start each rebalance from the previous medoids: seed (Gurobi MIP start; QUOB keeps the better of ReplicaTOR and a swap refinement) or only (QUOB skips ReplicaTOR)')
+
+    parser.add_argument('--warm_swaps', type=int, default=1000,
+                    help='Maximum swaps of the QUOB warm-start refinement')
+
+    parser.add_argument('--warm_time_fraction', type=float, default=0.25,
+                    help='Share of --time_limit ReplicaTOR gets with --warm_start seed, since it cannot start from the previous medoids')
+
+    parser.add_argument('--quob_backend', type=str, default='replicator', choices=['replicator', 'numpy'],
+                    help='QUOB solver: the ReplicaTOR binary or the NumPy parallel tempering in prafa/tempering.py')
+
+    parser.add_argument('--polish_seconds', type=float, default=0,
+                    help='Time budget of the swap local search run on the QUOB/Gurobi selection (0 disables it; not applied with --gurobi_model knn)')
+
+    parser.add_argument('--gurobi_convexify', type=str, default='none', choices=['none', 'lanczos', 'gershgorin'],
+                    help='Give Gurobi the convex equivalent of its binary quadratic, shifting the diagonal by the largest eigenvalue of D (lanczos) or a per-row Gershgorin bound')
+
+    parser.add_argument('--gurobi_model', type=str, default='bqo', choices=['bqo', 'knn'],
+                    help='Gurobi formulation: the dense BQO_compact quadratic or a sparse facility-location model over each stock\'s nearest neighbours')
+
+    parser.add_argument('--gurobi_knn', type=int, default=20,
+                    help='Candidate medoids per stock (besides itself) in --gurobi_model knn')
+
+    parser.add_argument('--gurobi_trace_interval', type=float, default=0,
+                    help='Seconds between rows of the Gurobi incumbent/bound/gap trace written to <result_path>/gurobi_traces (0 disables it)')
+
+    parser.add_argument('--full_replication_solver', type=str, default='fista', choices=['fista', 'slsqp'],
+                    help='Solver of lagrange_full: FISTA with simplex projection on the Gram matrix, or the original SLSQP')
+
     parser.add_argument('--cardinality', type=int, default=300)
 
+    parser.add_argument('--prune_columns', action='store_true',
+                    help='Load only the permnos in the index between start_date and end_date, and only the dates needed from start_date - T years')
+
     # Select the Data to Use
     parser.add_argument('--start_date', type=str, default="2014-01-02")
     parser.add_argument('--end_date', type=str, default="2023-12-31")
@@ -40,6 +129,19 @@ def Main():
     parser.add_argument('--T', type=int, default=3, help="nombre d'année pour l'entrainement")
     parser.add_argument('--rebalancing', type=int, default=12, help="Month increment for rebalancing")
     args = parser.parse_args()
+    if args.dist_format == 'binary' and args.quob_backend != 'numpy':
+        parser.error("--dist_format binary is only read by --quob_backend numpy; ReplicaTOR reads text matrices")
+    try:
+        compile_progress_pattern(args.cost_pattern)
+    except (re.error, ValueError) as error:
+        parser.error(f"--cost_pattern: {error}")
+    if (args.stall_seconds or args.stall_rounds) and args.quob_backend == 'replicator' and args.cost_pattern is None:
+        #le motif par défaut est celui de prafa.tempering : sans ligne reconnue, l'arret anticipé ne se déclencherait jamais
+        print("⚠️ --stall_seconds/--stall_rounds are disabled: the default progress pattern is prafa.tempering's format, "
+              "not checked against ReplicaTOR's output. Pass --cost_pattern for this ReplicaTOR build to enable the stall stop.")
+        args.stall_seconds = args.stall_rounds = None
+    if args.adjacency == 'knn' and args.quob_backend == 'numpy':
+        parser.error("--adjacency knn needs --quob_backend replicator; the NumPy backend always solves the complete graph")
     
   
 
@@ -64,10 +166,11 @@ def Main():
     
     #initialisation des object necessaire pour extraire les portefeuilles dans le temps
     portfolio = Portfolio(Universe(args))
-    for rebalancing_date in dates:
-        start_datetime = rebalancing_date - portfolio_duration
-        portfolio.rebalance_portfolio(start_datetime, rebalancing_date)
-        print(f"Rebalancing from {start_datetime.date()} to {rebalancing_date.date()}")
+    periods = [(rebalancing_date - portfolio_duration, rebalancing_date) for rebalancing_date in dates]
+    try:
+        portfolio.rebalance_portfolios(periods, workers=args.workers)
+    finally:
+        portfolio.close()
 
     
     return None
@@ -0,0 +1,60 @@
+"""Point-in-time index membership built once from the yearly constituent files.
+
+``financial_data/<index>/constituants/{year}.csv`` lists the permnos in the
+index for a given year.  ``Membership`` stacks every snapshot into a boolean
+matrix (effective dates x permnos) so that "who is in the index on date d" is a
+``searchsorted`` on the effective dates followed by a row lookup, instead of a
+CSV read each time the year changes.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+class Membership:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+        #un fichier par année, effectif à partir du 1er janvier (all_permnos.csv est ignoré)
+        files = sorted(p for p in self.directory.glob("*.csv") if p.stem.isdigit())
+        if not files:
+            raise FileNotFoundError(f"No yearly constituent files found in '{self.directory}'")
+
+        snapshots = [
+            pd.read_csv(path, dtype={"permno": str})["permno"].dropna().str.strip().unique()
+            for path in files
+        ]
+        self.dates = pd.DatetimeIndex([pd.Timestamp(year=int(p.stem), month=1, day=1) for p in files])
+        self.permnos = pd.Index(sorted(set().union(*snapshots)), dtype=object)
+
+        column_of = {permno: j for j, permno in enumerate(self.permnos)}
+        self.matrix = np.zeros((len(files), len(self.permnos)), dtype=bool)
+        for i, snapshot in enumerate(snapshots):
+            self.matrix[i, [column_of[p] for p in snapshot]] = True
+
+        self._dates64 = self.dates.to_numpy(dtype="datetime64[ns]")
+
+    def row_at(self, date) -> int:
+        """Index of the snapshot in effect on ``date`` (the latest one not after it)."""
+
+        row = int(np.searchsorted(self._dates64, np.datetime64(pd.Timestamp(date), "ns"), side="right")) - 1
+        if row < 0:
+            raise ValueError(
+                f"No constituent snapshot in '{self.directory}' is effective on {pd.Timestamp(date).date()}"
+            )
+        return row
+
+    def mask_at(self, date) -> np.ndarray:
+        return self.matrix[self.row_at(date)]
+
+    def members_at(self, date) -> pd.Index:
+        return self.permnos[self.mask_at(date)]
+
+    def members_between(self, start, end) -> pd.Index:
+        """Union of the members of every snapshot in effect between ``start`` and ``end``."""
+
+        first, last = self.row_at(start), self.row_at(end)
+        return self.permnos[self.matrix[first : last + 1].any(axis=0)]
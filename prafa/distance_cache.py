@@ -0,0 +1,120 @@
+"""Content-addressed on-disk cache of distance matrices.
+
+Comparing ``quob``, ``quob_cor``, ``gurobi`` and ``gurobi_cor`` or sweeping
+``--cardinality`` solves the same training windows again and again, and each
+run rebuilds the same n x n distance matrix.  ``DistanceCache`` stores every
+matrix as ``<root>/<key>.npy`` where the key hashes what determines its
+values::
+
+    index, ordered permno list, window start/end, distance method, Welsch transform,
+    NaN handling ("one": NaN/inf distances replaced by 1, "keep": left as computed),
+    zero diagonal (entries written before the diagonal was zeroed get other keys)
+
+The dcor engine is not part of the key: both engines give the same matrix up
+to rounding.  Reading an entry refreshes its modification time, and after
+each write the least recently used entries are deleted until the directory
+fits in ``max_bytes``.  The solvers go through ``get_or_compute``, so a hit
+skips the whole computation.  Eviction only considers files named like entries
+(``KEY_PATTERN``), so other files in the root are never deleted.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MAX_BYTES = 10 << 30  # 10 GiB
+KEY_PATTERN = re.compile(r"[0-9a-f]{40}\.npy")  #nom des entrées : sha1 hexadécimal
+
+
+class DistanceCache:
+    def __init__(self, root, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(index: str, permnos, start, end, method: str, welsch: bool = True, nan: str = "one") -> str:
+        """Hex digest identifying the distance matrix of a window."""
+
+        digest = hashlib.sha1()
+        for part in (
+            index,
+            hashlib.sha1("\n".join(str(p) for p in permnos).encode()).hexdigest(),
+            pd.Timestamp(start).isoformat(),
+            pd.Timestamp(end).isoformat(),
+            method,
+            "welsch" if welsch else "raw",
+            f"nan={nan}",
+            "diagonal=0",
+        ):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    @staticmethod
+    def get_or_compute(cache, key: str, compute):
+        """Matrix for ``key`` from ``cache``, or ``compute()`` stored in it on a miss; ``cache`` may be None."""
+
+        if cache is not None:
+            matrix = cache.get(key)
+            if matrix is not None:
+                return matrix
+        matrix = compute()
+        if cache is not None:
+            cache.put(key, matrix)
+        return matrix
+
+    def path(self, key: str) -> Path:
+        return self.root / f"{key}.npy"
+
+    def get(self, key: str):
+        """Cached matrix for ``key``, or None on a miss."""
+
+        path = self.path(key)
+        try:
+            matrix = np.load(path)
+        except (FileNotFoundError, ValueError, EOFError):
+            #absent, ou fichier tronqué/évincé par un autre processus pendant la lecture
+            return None
+        #mtime = dernière utilisation, pour l'éviction LRU (atime n'est pas fiable avec noatime)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return matrix
+
+    def put(self, key: str, matrix: np.ndarray) -> None:
+        path = self.path(key)
+        #écriture dans un fichier temporaire puis rename, plusieurs processus peuvent remplir le cache
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            np.save(f, np.asarray(matrix, dtype=np.float64))
+        os.replace(tmp, path)
+        self.evict(keep=path)
+
+    def evict(self, keep: Path = None) -> None:
+        """Delete the least recently used entries until the cache fits in ``max_bytes``."""
+
+        entries = []
+        for path in self.root.glob("*.npy"):
+            if not KEY_PATTERN.fullmatch(path.name):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
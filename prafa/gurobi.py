@@ -1,10 +1,17 @@
 
+import threading
+
 import gurobipy as gp
 from gurobipy import GRB
-import dcor
 import numpy as np
 import pandas as pd
-from scipy.optimize import minimize
+import scipy.sparse as sp
+from scipy.sparse.linalg import eigsh
+
+from prafa.distance import dcor_distance_matrix, pearson_distance_matrix
+from prafa.distance_cache import DistanceCache
+from prafa.warm_start import complete_selection, polish
+from prafa.weights import tracking_weights
 
 
 params = {
@@ -16,8 +23,168 @@ params = {
 #env = gp.Env(params=params) 
 
 
+CONVEXIFY_METHODS = ('none', 'lanczos', 'gershgorin')
+
+
+def convexifying_shift(D, alpha, method='lanczos'):
+    """Diagonal shift s making -0.5*alpha*D + diag(s) positive semidefinite.
+
+    Since z_i**2 == z_i for binary z, adding s @ (z * z) - s @ z to the objective
+    leaves it unchanged on every feasible point while the quadratic becomes convex.
+    """
+
+    n = D.shape[0]
+    if method == 'lanczos':
+        #plus grande valeur propre de D (Lanczos), marge pour la tolérance d'ARPACK
+        lambda_max = eigsh(np.asarray(D, dtype=np.float64), k=1, which='LA', return_eigenvectors=False)[0]
+        return np.full(n, 0.5 * alpha * lambda_max * (1 + 1e-6) + 1e-9)
+    if method == 'gershgorin':
+        #dominance diagonale ligne par ligne : s_i >= 0.5*alpha*(D_ii + sum_{j != i} |D_ij|)
+        return 0.5 * alpha * (np.abs(D).sum(axis=1) - np.abs(np.diag(D)) + np.diag(D))
+    raise ValueError(f"Unknown convexification method '{method}' (expected one of {CONVEXIFY_METHODS})")
+
+
+MODELS = ('bqo', 'knn')
+
+
+def nearest_neighbours(D, k):
+    """Each stock followed by its ``k`` nearest neighbours: (rows, cols) of the n*(k+1) candidate assignments."""
+
+    n = D.shape[0]
+    k = min(k, n - 1)
+    masked = np.array(D, dtype=np.float64)
+    np.fill_diagonal(masked, np.inf)
+    neighbours = np.argpartition(masked, k - 1, axis=1)[:, :k] if k > 0 else np.empty((n, 0), dtype=np.intp)
+    #le stock lui-meme est toujours candidat : il peut etre son propre médoïde
+    cols = np.concatenate([np.arange(n)[:, None], neighbours], axis=1)
+    return np.repeat(np.arange(n), k + 1), cols.ravel()
+
+
+TRACE_COLUMNS = ("elapsed_seconds", "incumbent", "bound", "gap", "nodes")
+TRACE_METADATA = ("solver", "index", "cardinality", "window_end")
+
+
+class MIPTrace:
+    """MIP callback recording (elapsed, incumbent, bound, gap, nodes) of one solve.
+
+    A row is kept at most every ``interval`` seconds during the search, at
+    every new incumbent, and once at the end with the final model attributes.
+    ``write`` puts the solve's ``TRACE_METADATA`` in constant leading columns,
+    so readers never have to parse the file name.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.rows = []
+        self.last = -np.inf
+
+    def __call__(self, model, where):
+        if where == GRB.Callback.MIP:
+            elapsed = model.cbGet(GRB.Callback.RUNTIME)
+            if elapsed - self.last < self.interval:
+                return
+            self.record(elapsed, model.cbGet(GRB.Callback.MIP_OBJBST), model.cbGet(GRB.Callback.MIP_OBJBND),
+                        model.cbGet(GRB.Callback.MIP_NODCNT))
+        elif where == GRB.Callback.MIPSOL:
+            #nouvelle solution entière : toujours enregistrée, c'est elle qui date la dernière amélioration
+            incumbent = min(model.cbGet(GRB.Callback.MIPSOL_OBJ), model.cbGet(GRB.Callback.MIPSOL_OBJBST))
+            self.record(model.cbGet(GRB.Callback.RUNTIME), incumbent, model.cbGet(GRB.Callback.MIPSOL_OBJBND),
+                        model.cbGet(GRB.Callback.MIPSOL_NODCNT))
+
+    def record(self, elapsed, incumbent, bound, nodes):
+        #GRB.INFINITY : pas encore de solution (ou de borne)
+        incumbent = incumbent if abs(incumbent) < GRB.INFINITY else np.nan
+        bound = bound if abs(bound) < GRB.INFINITY else np.nan
+        gap = abs(incumbent - bound) / max(abs(incumbent), 1e-10)
+        self.rows.append((elapsed, incumbent, bound, gap, nodes))
+        self.last = elapsed
+
+    def finish(self, model):
+        incumbent = model.ObjVal if model.SolCount > 0 else np.nan
+        self.record(model.Runtime, incumbent, model.ObjBound, model.NodeCount)
+
+    def write(self, path, metadata=None):
+        trace = pd.DataFrame(self.rows, columns=TRACE_COLUMNS)
+        for position, name in enumerate(name for name in TRACE_METADATA if metadata and name in metadata):
+            trace.insert(position, name, metadata[name])
+        trace.to_csv(path, index=False)
+
+
+class GurobiSession:
+    """Gurobi environment, and the dense BQO model, kept for a whole backtest.
+
+    The WLS licence is checked out once, on the first solve.  While the number
+    of stocks does not change, the BQO model keeps its variables and its
+    cardinality constraint: a rebalance only replaces the objective
+    (``setMObjective``) and the right-hand side K.  The kNN model changes
+    sparsity with every window and is rebuilt in the same environment, next to
+    the BQO model (``new_model`` never disposes it).  ``close`` disposes the
+    models and the environment, which releases the licence; the owner calls it
+    once the backtest is done, or uses the session as a context manager.
+    """
+
+    def __init__(self, env_params=None):
+        self.env_params = params if env_params is None else env_params
+        self.env = None
+        self.scratch = None #dernier modèle jetable (kNN)
+        self.model = None #modèle BQO réutilisé
+        self.z = None
+        self.card = None
+        self.lock = threading.Lock() #un solve à la fois par session (fenetres résolues dans des threads)
+
+    def environment(self):
+        if self.env is None:
+            self.env = gp.Env(params=self.env_params)
+        return self.env
+
+    def new_model(self, name):
+        #modèle jetable dans l'environnement de la session, le modèle BQO reste en place
+        if self.scratch is not None:
+            self.scratch.dispose()
+        self.scratch = gp.Model(name, env=self.environment())
+        return self.scratch
+
+    def bqo_model(self, n, K):
+        """(model, z) of the BQO model on ``n`` stocks with cardinality ``K``, reused when ``n`` is unchanged."""
+
+        if self.z is None or self.z.shape[0] != n:
+            self.discard()
+            m = self.model = gp.Model("BQO_compact", env=self.environment())
+            self.z = m.addMVar(n, vtype=GRB.BINARY, name="z")
+            self.card = m.addConstr(np.ones(n) @ self.z == K, name="card")
+        else:
+            #oublie la solution et le MIP start du rebalancement précédent
+            self.model.reset(1)
+            self.card.RHS = K
+        return self.model, self.z
+
+    def discard(self):
+        #oublie le modèle BQO (nouveau nombre de stocks)
+        if self.model is not None:
+            self.model.dispose()
+        self.model = self.z = self.card = None
+
+    def close(self):
+        if self.scratch is not None:
+            self.scratch.dispose()
+            self.scratch = None
+        self.discard()
+        if self.env is not None:
+            self.env.dispose()
+            self.env = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 class Gurobi:
-    def __init__(self, stocks_returns, index_returns, K, simple_corr=False, time_limit=300):
+    def __init__(self, stocks_returns, index_returns, K, simple_corr=False, time_limit=300, threads=0,
+                 dcor_engine='blas', dcor_workers=1, corr_matrix=None, distance_cache=None, distance_key=None,
+                 warm_start=None, polish_seconds=0, convexify='none', model='bqo', knn=20, session=None,
+                 trace_path=None, trace_interval=5.0, trace_metadata=None):
         #matrice et vecteur numpy
         self.stocks_returns = stocks_returns
         self.index_returns = index_returns
@@ -25,47 +192,61 @@ class Gurobi:
         self.idx = None #liste d'indice des stonks choisit
         self.simple_corr = simple_corr
         self.time_limit = time_limit
+        self.threads = threads #0 -> Gurobi choisit
+        self.dcor_engine = dcor_engine #'blas' (produits matriciels) ou 'fast' (O(T log T), processus)
+        self.dcor_workers = dcor_workers
+        self.corr_matrix = corr_matrix #corrélation des totaux X^T X glissants, ou fonction qui l'assemble (appelée seulement si la distance manque au cache), sinon np.corrcoef
+        self.distance_cache = distance_cache #DistanceCache partagé avec QUOB, None -> toujours recalculer
+        self.distance_key = distance_key
+        self.warm_start = warm_start #médoïdes du rebalancement précédent (indices dans cet univers), donnés en MIP start
+        self.polish_seconds = polish_seconds #budget des échanges après Gurobi, 0 -> pas de polissage
+        self.convexify = convexify #'lanczos' ou 'gershgorin' : modèle convexe équivalent, 'none' : non convexe
+        self.model = model #'bqo' : BQO_compact dense, 'knn' : facility location sur les k plus proches voisins
+        self.knn = knn
+        self.trace_path = trace_path #CSV de la trajectoire incumbent/borne/gap, None -> pas de callback
+        self.trace_interval = trace_interval #secondes entre deux lignes de la trace
+        self.trace_metadata = trace_metadata #solver, index, cardinality, window_end : colonnes constantes de la trace
+        self.session = session #GurobiSession du Portfolio, None -> environnement ouvert et fermé pour ce solve
+        self.D = None
         
         
 
 
-    def matrix_dcor(self):
-        
-        Welsch_function = lambda x : 1 - np.exp(-0.5 * x)
+    def distance_matrix(self):
+        return DistanceCache.get_or_compute(
+            self.distance_cache, self.distance_key, self.matrix_simplecor if self.simple_corr else self.matrix_dcor
+        )
+
 
-        n = self.stocks_returns.shape[1]
-        dcor_mat = np.zeros((n, n))
+    def matrix_dcor(self):
         
-        for i in range(n):
-            for j in range(i, n):
-                dcor_val = dcor.distance_correlation(self.stocks_returns[:, i], self.stocks_returns[:, j])
-                dist = 1 - dcor_val
-                dcor_mat[i, j] = dcor_mat[j, i] = Welsch_function(dist) #Welsch_function(dist)
-    
-        return dcor_mat
+        #Welsch_function(1 - dcor) sur toutes les paires, moteur choisi par dcor_engine ; NaN laissés tels quels
+        return dcor_distance_matrix(self.stocks_returns, engine=self.dcor_engine, workers=self.dcor_workers)
         
 
 
     def matrix_simplecor(self):
-        Welsch_function = lambda x : 1 - np.exp(-0.5 * x)
-        distance_func = lambda di : np.sqrt(0.5*(1 - di))
-
-        n = self.stocks_returns.shape[1]
-        corr_matrix = np.corrcoef(self.stocks_returns, rowvar=False)
-        
-        distance_matrix = distance_func(corr_matrix)
-        return Welsch_function(distance_matrix)
+        #Welsch_function(sqrt(0.5 * (1 - corr))), mêmes valeurs que QUOB pour partager le cache
+        return pearson_distance_matrix(self.stocks_returns, self.corr_matrix)
 
 
     def stock_picking(self, n):
         #résolution du probleme d'optimisation 
         #retourne une liste d'indice des stonks sélectionné
         #construire ma matrice de distance
-        if self.simple_corr:
-            D = self.matrix_simplecor()
-        else:
-            D = self.matrix_dcor()
+        D = self.distance_matrix()
+        self.D = D
 
+        session = self.session if self.session is not None else GurobiSession()
+        try:
+            with session.lock:
+                return self.solve(session, D)
+        finally:
+            if self.session is None:
+                session.close()
+
+
+    def solve(self, session, D):
         n = D.shape[0]
         alpha = 1 / self.K
         beta = 1 / n
@@ -73,39 +254,68 @@ class Gurobi:
         ones = np.ones(n)
         c = beta * (D @ ones)   # c = β Δ 1
 
-        #m = gp.Model("BQO_compact")
-        #m.Params.NonConvex = 2
-        with gp.Env(params=params) as env, gp.Model(env=env) as m:
-            m.setParam("TimeLimit", self.time_limit)
-
+        if self.model == 'knn':
+            m = session.new_model("kNN_facility_location")
             z = m.addMVar(n, vtype=GRB.BINARY, name="z")
+            self.facility_location(m, z, D)
+        else:
+            #variables et contrainte de cardinalité réutilisées si n n'a pas changé
+            m, z = session.bqo_model(n, self.K)
+            # Objectif entièrement matriciel : z^T Q z + c^T z
+            Q = -0.5 * alpha * np.asarray(D, dtype=np.float64)
+            if self.convexify != 'none':
+                #z_i^2 = z_i : on ajoute s_i z_i^2 - s_i z_i, meme objectif sur les binaires mais Q semi-définie positive
+                shift = convexifying_shift(D, alpha, self.convexify)
+                Q[np.diag_indices(n)] += shift
+                c = c - shift
+            m.setMObjective(Q, c, 0.0, z, z, z, GRB.MINIMIZE)
 
-            # Objectif entièrement matriciel
-            m.setObjective(c @ z - 0.5 * alpha * (z @ D @ z), GRB.MINIMIZE)
-
-            # Contrainte de cardinalité
-            m.addConstr(ones @ z == self.K, name="card")
+        m.setParam("TimeLimit", self.time_limit)
+        m.setParam("Threads", self.threads)
+        if self.warm_start is not None:
+            #MIP start : sélection précédente complétée à K médoïdes
+            start = np.zeros(n)
+            start[complete_selection(D, self.warm_start, self.K)] = 1
+            z.Start = start
 
+        if self.trace_path is None:
             m.optimize()
-            return z.X
+        else:
+            trace = MIPTrace(self.trace_interval)
+            m.optimize(trace)
+            trace.finish(m)
+            trace.write(self.trace_path, self.trace_metadata)
+        return z.X
+
+
+    def facility_location(self, m, z, D):
+        #k-medoids creux : x_e affecte le stock i au médoïde candidat j (i lui-meme ou un de ses k voisins)
+        #taille O(n k) au lieu des n^2 termes quadratiques de z @ D @ z
+        n = D.shape[0]
+        rows, cols = nearest_neighbours(D, self.knn)
+        edges = rows.size
+        x = m.addMVar(edges, lb=0.0, ub=1.0, name="x")
+        #stock sans médoïde parmi ses candidats : pénalité égale à sa plus grande distance
+        u = m.addMVar(n, lb=0.0, ub=1.0, name="u")
+
+        assign = sp.csr_matrix((np.ones(edges), (rows, np.arange(edges))), shape=(n, edges))
+        link = sp.csr_matrix((np.ones(edges), (np.arange(edges), cols)), shape=(edges, n))
+        m.addConstr(assign @ x + u == np.ones(n), name="assign")
+        m.addConstr(x - link @ z <= np.zeros(edges), name="link")
+        m.addConstr(np.ones(n) @ z == self.K, name="card")
+
+        m.setObjective(np.asarray(D[rows, cols], dtype=np.float64) @ x + np.asarray(D.max(axis=1), dtype=np.float64) @ u,
+                       GRB.MINIMIZE)
 
 
     def calc_weights(self):
         stock_pick_binary = self.stock_picking(self.stocks_returns.shape[1])
-        self.idx = np.where(stock_pick_binary == 1)[0].tolist()
-        subset_returns = self.stocks_returns[:, self.idx]
-        
-        initial_weight = np.ones(len(self.idx))
-        initial_weight /= initial_weight.sum()  
-        bounds = [(0, 1) for _ in range(len(self.idx))]
-
-        # Define Constraints    
-        constraint = {'type': 'eq', 'fun':lambda weight : np.sum(weight) - 1}
-        objective_function = lambda weight : np.sum((subset_returns @ weight - self.index_returns)**2)
-        
-        # Optimization
-        result = minimize(objective_function, initial_weight, method = 'SLSQP', constraints=constraint, bounds=bounds)
-        return result.x
+        #binaires rendus à IntFeasTol près (0.9999999) : seuil à 0.5 plutot qu'une égalité exacte
+        self.idx = np.flatnonzero(stock_pick_binary > 0.5).tolist()
+        #le polissage minimise l'objectif BQO : il n'a pas de sens pour le modèle k-médoïdes (knn)
+        if self.polish_seconds > 0 and self.model == 'bqo':
+            self.idx = polish(self.D, self.idx, self.K, self.polish_seconds)
+        return tracking_weights(self.stocks_returns[:, self.idx], self.index_returns)
 
     
     def get_weights(self):
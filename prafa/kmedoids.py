@@ -0,0 +1,177 @@
+"""In-process k-medoids on the QUOB/Gurobi distance matrix.
+
+The QUOB path needs the external ReplicaTOR binary and the Gurobi path needs a
+licence; both take minutes per window.  ``KMedoids`` solves the classic
+k-medoids problem (minimise the sum over stocks of the distance to their
+nearest medoid) on the same Welsch-transformed distance matrix with plain
+NumPy:
+
+* ``build``: the greedy BUILD initialisation of PAM, one medoid at a time,
+  each step adding the candidate with the largest drop in total deviation.
+* ``faster_pam``: the FasterPAM swap search (Schubert & Rousseeuw, 2021).
+  For a candidate x, the change of total deviation for swapping x with every
+  medoid comes from one O(n) pass over the points, using their nearest and
+  second-nearest medoid distances, and the first improving swap is applied
+  right away.  The search stops after a full pass over the candidates
+  without improvement.
+
+The medoids are then weighted by the same simplex least-squares fit as QUOB
+and Gurobi (``prafa.weights``).
+"""
+from __future__ import annotations
+
+import numpy as np
+
+from prafa.distance import dcor_distance_matrix, pearson_distance_matrix
+from prafa.distance_cache import DistanceCache
+from prafa.warm_start import complete_selection
+from prafa.weights import tracking_weights
+
+
+def build(D: np.ndarray, K: int, chunk: int = 512) -> np.ndarray:
+    """Greedy BUILD initialisation; returns K medoid indices."""
+
+    n = D.shape[0]
+    #float32 et tampon réutilisé : chaque étape parcourt toute la matrice n x n
+    D32 = np.asarray(D, dtype=np.float32)
+    medoids = [int(np.argmin(D.sum(axis=1)))]
+    nearest = D32[medoids[0]].copy()
+    buffer = np.empty((min(chunk, n), n), dtype=np.float32)
+    gain = np.empty(n)
+    for _ in range(1, K):
+        #baisse de la déviation totale si chaque candidat devient médoïde
+        for start in range(0, n, chunk):
+            stop = min(start + chunk, n)
+            block = buffer[: stop - start]
+            np.subtract(nearest, D32[start:stop], out=block)
+            np.maximum(block, 0.0, out=block)
+            gain[start:stop] = block.sum(axis=1)
+        gain[medoids] = -np.inf
+        m = int(np.argmax(gain))
+        medoids.append(m)
+        np.minimum(nearest, D32[m], out=nearest)
+    return np.asarray(medoids, dtype=np.intp)
+
+
+def _nearest_two(D: np.ndarray, medoids: np.ndarray, points=slice(None)):
+    #plus proche et second médoïde (positions dans medoids) de chaque point, avec leurs distances
+    block = D[medoids][:, points]
+    if medoids.size == 1:
+        zeros = np.zeros(block.shape[1], dtype=np.intp)
+        return zeros, zeros - 1, block[0], np.full(block.shape[1], np.inf)
+    two = np.argpartition(block, 1, axis=0)[:2]
+    d_two = np.take_along_axis(block, two, axis=0)
+    swap = d_two[1] < d_two[0]
+    return (
+        np.where(swap, two[1], two[0]),
+        np.where(swap, two[0], two[1]),
+        np.where(swap, d_two[1], d_two[0]),
+        np.where(swap, d_two[0], d_two[1]),
+    )
+
+
+def faster_pam(D: np.ndarray, medoids, max_iter: int = 100, tol: float = 1e-12):
+    """FasterPAM swap search from ``medoids``; returns (medoids, total deviation, swaps)."""
+
+    D = np.asarray(D, dtype=np.float64)
+    n = D.shape[0]
+    medoids = np.array(medoids, dtype=np.intp)
+    K = medoids.size
+    if K == 1:
+        #pas de second médoïde (d2 infini, delta NaN) : l'optimum est le point de plus petite somme de distances
+        best = int(np.argmin(D.sum(axis=1)))
+        return np.array([best], dtype=np.intp), float(D[best].sum()), int(best != medoids[0])
+
+    is_medoid = np.zeros(n, dtype=bool)
+    is_medoid[medoids] = True
+
+    near, second, d1, d2 = _nearest_two(D, medoids)
+    removal = np.bincount(near, weights=d2 - d1, minlength=K)
+
+    swaps = 0
+    last_swap = 0
+    x = 0
+    for step in range(max_iter * n):
+        if step - last_swap >= n and step > 0:
+            break
+        if not is_medoid[x]:
+            d_x = D[x]
+            closer = d_x < d1
+            between = ~closer & (d_x < d2)
+            #x devient le plus proche : gain sur d1, et retirer son ancien médoïde coute d2 -> d1
+            acc = np.sum(d_x[closer] - d1[closer])
+            delta = removal + acc
+            delta += np.bincount(near[closer], weights=d1[closer] - d2[closer], minlength=K)
+            delta += np.bincount(near[between], weights=d_x[between] - d2[between], minlength=K)
+            i = int(np.argmin(delta))
+            if delta[i] < -tol:
+                old = medoids[i]
+                medoids[i] = x
+                is_medoid[old], is_medoid[x] = False, True
+                #seuls les points dont le plus proche ou le second était old, ou que x rapproche, changent
+                affected = np.flatnonzero((near == i) | (second == i) | (d_x < d2))
+                near[affected], second[affected], d1[affected], d2[affected] = _nearest_two(D, medoids, affected)
+                removal = np.bincount(near, weights=d2 - d1, minlength=K)
+                swaps += 1
+                last_swap = step
+        x = (x + 1) % n
+    return medoids, float(d1.sum()), swaps
+
+
+class KMedoids:
+    def __init__(self, stocks_returns, index_returns, K, simple_corr=False, distance_method='dcor',
+                 dcor_engine='blas', dcor_workers=1, corr_matrix=None, distance_cache=None, distance_key=None,
+                 warm_start=None, max_iter=100):
+        #matrice et vecteur numpy
+        self.stocks_returns = stocks_returns
+        self.index_returns = index_returns
+        self.K = K #cardinalité!!
+        self.pearson = simple_corr or distance_method == 'pearson'
+        self.dcor_engine = dcor_engine
+        self.dcor_workers = dcor_workers
+        self.corr_matrix = corr_matrix
+        self.distance_cache = distance_cache #meme cache que QUOB et Gurobi
+        self.distance_key = distance_key
+        self.warm_start = warm_start #médoïdes précédents à la place de BUILD
+        self.max_iter = max_iter
+        self.idx = None
+        self.D = None
+
+
+    def distance_matrix(self):
+        return DistanceCache.get_or_compute(self.distance_cache, self.distance_key, self.compute_distance_matrix)
+
+
+    def compute_distance_matrix(self):
+        if self.pearson:
+            return pearson_distance_matrix(self.stocks_returns, self.corr_matrix)
+        D = dcor_distance_matrix(self.stocks_returns, engine=self.dcor_engine, workers=self.dcor_workers)
+        return np.nan_to_num(D, nan=1.0, posinf=1.0, neginf=1.0)
+
+
+    def stock_picking(self):
+        self.D = self.distance_matrix()
+        K = min(self.K, self.D.shape[0])
+        if self.warm_start is not None:
+            #médoïdes précédents, complétés à K
+            initial = complete_selection(self.D, self.warm_start, K)
+        else:
+            initial = build(self.D, K)
+        medoids, _, _ = faster_pam(self.D, initial, max_iter=self.max_iter)
+        return sorted(medoids.tolist())
+
+
+    def calc_weights(self):
+        self.idx = self.stock_picking()
+        return tracking_weights(self.stocks_returns[:, self.idx], self.index_returns)
+
+
+    def get_weights(self):
+        #retourne numpy array sparse des poids
+        weight_global = np.zeros(self.stocks_returns.shape[1])
+
+        micro_weight = self.calc_weights()
+        for i in range(len(micro_weight)):
+            weight_global[self.idx[i]] = micro_weight[i]
+
+        return weight_global
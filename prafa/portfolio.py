@@ -1,12 +1,22 @@
 import numpy as np
-from prafa.universe import Universe
+from prafa.universe import Universe, UniverseWindow
 from prafa.quob import QUOB
-from prafa.gurobi import Gurobi
+from prafa.gurobi import Gurobi, GurobiSession
+from prafa.kmedoids import KMedoids
+from prafa.rolling_covariance import RollingCovariance
+from prafa.distance_cache import DistanceCache
+from prafa.replicator_runner import ReplicatorScheduler, StallPolicy, available_cpus
+from prafa.warm_start import Selection
+from prafa.weights import full_replication_weights
 from datetime import datetime
 import time
 import pandas as pd
 import json
+import os
+import copy
 import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from scipy.optimize import minimize
 
 
@@ -14,16 +24,80 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 """
-Cette classe centralise le code. Elle qui mets a jour l'univers et ensuite calcule L'optimisation et stack la reponse ici avec la date 
-Faire bien attention de bien ajuster universe avant optimization parce l'universe est réutiliser dans L'optimisation , mais on la récupere 
-a partir de portfolio
+Cette classe centralise le code. Elle extrait une fenetre de l'univers (UniverseWindow, immuable) et ensuite calcule L'optimisation
+et stack la reponse ici avec la date. La solution ne lit que la fenetre qu'on lui donne, jamais l'état de l'univers, 
+ce qui permet de résoudre plusieurs dates de rebalancement en meme temps.
 """
 
 
+#variables d'environnement qui fixent le nombre de threads BLAS/OpenMP des processus de travail
+BLAS_THREAD_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+def threads_per_worker(workers : int) -> int:
+    #partage des coeurs autorisés (taskset/cgroups) entre les processus de travail
+    return max(1, len(available_cpus()) // max(1, workers))
+
+
+def worker_args(args, workers : int):
+    """
+        Copie des arguments avec le budget de threads d'un processus de travail :
+        ReplicaTOR demande une puissance de 2 (num_cores_per_controller), Gurobi prend Threads.
+    """
+    budget = threads_per_worker(workers)
+    args = copy.copy(args)
+    args.replicator_cores = 1 << (min(args.replicator_cores, budget).bit_length() - 1)
+    args.gurobi_threads = min(args.gurobi_threads, budget) if args.gurobi_threads > 0 else budget
+    args.dcor_workers = max(1, min(args.dcor_workers, budget))
+    return args
+
+
+def solve_window(window : UniverseWindow, args, rolling_covariance=None, distance_cache=None, scheduler=None,
+                 gurobi_session=None):
+    #point d'entrée des processus de travail : une fenetre -> des poids
+    return Solution(window, args, rolling_covariance, distance_cache, scheduler,
+                    gurobi_session=gurobi_session).solve()
+
+
 class Portfolio:
     def __init__(self, universe: Universe):
         self.universe = universe
+
+        #totaux X^T X glissants pour assembler les corrélations de Pearson (désactivé par défaut),
+        #sur les seuls membres de l'indice pendant la période du backtest
+        self.rolling_covariance = None
+        if getattr(universe.args, "rolling_covariance", False):
+            self.rolling_covariance = RollingCovariance(
+                universe.returns_all,
+                universe.membership.members_between(universe.args.start_date, universe.args.end_date),
+            )
+
+        #matrices de distance déjà calculées, partagées entre les méthodes et les cardinalités (désactivé par défaut)
+        self.distance_cache = None
+        if getattr(universe.args, "distance_cache", None):
+            self.distance_cache = DistanceCache(
+                universe.args.distance_cache, int(universe.args.distance_cache_gb * (1 << 30))
+            )
+
+        #ordonnanceur des processus ReplicaTOR : les fenetres sont résolues dans des threads qui se partagent les coeurs
+        self.scheduler = None
+        if getattr(universe.args, "replicator_scheduler", False):
+            self.scheduler = ReplicatorScheduler()
         
+        #environnement Gurobi (licence WLS) et modèle BQO gardés d'un rebalancement à l'autre
+        self.gurobi_session = None
+        if universe.args.solution_name in ('gurobi', 'gurobi_cor'):
+            self.gurobi_session = GurobiSession()
+
+        #médoïdes du dernier rebalancement, point de départ du suivant avec --warm_start
+        self.previous_selection = None
+
         self.portfolios = {}  # Dictionnaire pour stocker les portefeuilles par date (le portfeuille est un dictionnaire de poids)
     
     def rebalance_portfolio(self,
@@ -32,13 +106,80 @@ class Portfolio:
     )   :
         #la fenetre de temps est celle de l'entrainement donc, on regarde composition de la end_date et se sert des
         #données passées pour résoudre le probleme d'optimisation et ainsi trouver les poids optimiaux
-        self.universe.new_universe(start_datetime, end_datetime)
-        sol = Solution(self)
+        window = self.universe.window(start_datetime, end_datetime)
+        sol = Solution(window, self.universe.args, self.rolling_covariance, self.distance_cache, self.scheduler,
+                       self.previous_selection, self.gurobi_session)
 
         self.portfolios[end_datetime] = sol.solve() #dictionnire contenant poids
+        self.previous_selection = sol.selection
         return self.portfolios[end_datetime]
+
+    def rebalance_portfolios(self,
+        periods : list,
+        workers : int = 1
+    )   :
+        """
+            periods : liste de (start_datetime, end_datetime) d'entrainement.
+            Avec workers > 1, chaque fenetre est résolue dans un processus séparé (les fenetres sont indépendantes)
+            et les résultats sont rangés dans self.portfolios dans l'ordre des dates.
+            Avec l'ordonnanceur ReplicaTOR, les fenetres sont résolues dans des threads : il ne voit que les
+            coeurs de son processus et c'est lui qui répartit les coeurs entre les solves.
+            Le démarrage à chaud enchaine les fenetres : il n'est utilisé que lorsqu'elles sont résolues dans l'ordre.
+        """
+        if workers > 1 and getattr(self.universe.args, "warm_start", "none") != "none":
+            print("⚠️ --warm_start needs the windows solved in order; parallel windows start cold.")
+
+        if workers <= 1:
+            for start_datetime, end_datetime in periods:
+                self.rebalance_portfolio(start_datetime, end_datetime)
+                print(f"Rebalancing from {start_datetime.date()} to {end_datetime.date()}")
+            return self.portfolios
+
+        if self.scheduler is not None:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    (start_datetime, end_datetime, pool.submit(solve_window, self.universe.window(start_datetime, end_datetime), self.universe.args, self.rolling_covariance, self.distance_cache, self.scheduler, self.gurobi_session))
+                    for start_datetime, end_datetime in periods
+                ]
+                for start_datetime, end_datetime, future in sorted(futures, key=lambda item: item[1]):
+                    self.portfolios[end_datetime] = future.result()
+                    print(f"Rebalancing from {start_datetime.date()} to {end_datetime.date()}")
+            return self.portfolios
+
+        args = worker_args(self.universe.args, workers)
+        budget = str(threads_per_worker(workers))
+
+        #les processus 'spawn' importent numpy après avoir hérité de ces variables
+        previous_env = {name: os.environ.get(name) for name in BLAS_THREAD_VARIABLES}
+        os.environ.update({name: budget for name in BLAS_THREAD_VARIABLES})
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [
+                    (start_datetime, end_datetime, pool.submit(solve_window, self.universe.window(start_datetime, end_datetime), args, self.rolling_covariance, self.distance_cache))
+                    for start_datetime, end_datetime in periods
+                ]
+                for start_datetime, end_datetime, future in sorted(futures, key=lambda item: item[1]):
+                    self.portfolios[end_datetime] = future.result()
+                    print(f"Rebalancing from {start_datetime.date()} to {end_datetime.date()}")
+        finally:
+            for name, value in previous_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+        return self.portfolios
        
 
+    def close(self):
+        #arrete la boucle de l'ordonnanceur ReplicaTOR et libère la licence Gurobi ; appelé une fois le backtest terminé
+        if self.scheduler is not None:
+            self.scheduler.close()
+            self.scheduler = None
+        if self.gurobi_session is not None:
+            self.gurobi_session.close()
+            self.gurobi_session = None
+
     def get_universe(self) -> Universe:
         return self.universe
     
@@ -64,21 +205,33 @@ class Solution:
     
     def __init__(
         self,
-        portfolio : Portfolio,
+        window : UniverseWindow,
+        args,
+        rolling_covariance : RollingCovariance = None,
+        distance_cache : DistanceCache = None,
+        scheduler : ReplicatorScheduler = None,
+        previous_selection : Selection = None,
+        gurobi_session : GurobiSession = None,
         ):
         
-        self.portfolio = portfolio
-        self.universe =  portfolio.get_universe()
-        self.solution_name = self.universe.args.solution_name
-        self.num_assets = self.universe.get_number_of_stocks()
-        self.K = self.universe.args.cardinality
+        self.window = window
+        self.args = args
+        self.rolling_covariance = rolling_covariance
+        self.distance_cache = distance_cache
+        self.scheduler = scheduler
+        self.previous_selection = previous_selection
+        self.gurobi_session = gurobi_session
+        self.selection = None #médoïdes choisis par quob/gurobi, pour démarrer le rebalancement suivant
+        self.solution_name = args.solution_name
+        self.num_assets = window.num_assets
+        self.K = args.cardinality
         
         #self.new_return = np.array(self.universe.get_stocks_returns())
         #self.new_index = np.array(self.universe.get_index_returns())
         
-        self.new_return = self.universe.get_stocks_returns().values
-        self.new_index = self.universe.get_index_returns().values
-        self.stock_list = self.universe.get_stock_namme_in_order()
+        self.new_return = window.returns
+        self.new_index = window.index_returns
+        self.stock_list = pd.Index(window.permnos)
         
         
         self.eps = 0.0001
@@ -132,6 +285,11 @@ class Solution:
     def lagrange_full_replication(
         self
     ) -> dict :
+        if getattr(self.args, "full_replication_solver", "fista") == 'fista':
+            #FISTA + projection sur le simplexe, gradient analytique G w - b : quelques secondes pour n = 3000
+            weights = full_replication_weights(self.new_return, self.new_index)
+            return pd.Series(weights, index=self.stock_list)
+
         # Define initial weight
         initial_weight = np.ones(self.num_assets)
         initial_weight /= initial_weight.sum()  
@@ -143,7 +301,7 @@ class Solution:
         
         # Optimization
         result = minimize(self.objective_function, initial_weight, method = 'SLSQP', constraints=constraint, bounds=bounds)
-        weights = pd.Series(result.x, index=self.new_return.columns)
+        weights = pd.Series(result.x, index=self.stock_list)
         return weights 
 
     
@@ -233,48 +391,190 @@ class Solution:
     
     
 
+    def correlation_matrix(self):
+        #corrélation de Pearson assemblée à partir des totaux glissants, None si désactivé ou np.corrcoef moins cher
+        if self.rolling_covariance is None:
+            return None
+        return self.rolling_covariance.correlation(self.window)
+
+    def distance_key(self, pearson : bool, nan : str = 'one'):
+        #clé du cache de distances : indice, permnos ordonnés, fenetre, méthode, transformation de Welsch, NaN
+        if self.distance_cache is None:
+            return None
+        return DistanceCache.key(
+            self.args.index, self.window.permnos, self.window.start, self.window.end,
+            'pearson' if pearson else 'dcor', nan=nan,
+        )
+
+    def replicator_options(self, name : str) -> dict:
+        #trace des coûts (un fichier par fenetre si --cost_trace_dir) et critère d'arret de ReplicaTOR
+        trace_path = None
+        if self.args.cost_trace_dir:
+            os.makedirs(self.args.cost_trace_dir, exist_ok=True)
+            trace_path = os.path.join(
+                self.args.cost_trace_dir,
+                f"{name}_{self.args.index}_{self.args.cardinality}_{self.window.end:%Y-%m-%d}.csv",
+            )
+        stall = StallPolicy(self.args.stall_seconds, self.args.stall_rounds, self.args.stall_grace)
+        return {"trace_path": trace_path, "stall": stall, "cost_pattern": self.args.cost_pattern}
+
+    def gurobi_trace_options(self, name : str) -> dict:
+        #trajectoire du solve Gurobi, à coté des portefeuilles (--gurobi_trace_interval > 0)
+        #solveur, indice, K et fin de fenetre sont des colonnes du CSV : le nom du fichier n'est pas relu
+        if not self.args.gurobi_trace_interval:
+            return {"trace_path": None}
+        trace_dir = os.path.join(self.args.result_path, "gurobi_traces")
+        os.makedirs(trace_dir, exist_ok=True)
+        window_end = f"{self.window.end:%Y-%m-%d}"
+        return {
+            "trace_path": os.path.join(trace_dir, f"{name}_{self.args.index}_{self.args.cardinality}_{window_end}.csv"),
+            "trace_interval": self.args.gurobi_trace_interval,
+            "trace_metadata": {
+                "solver": name, "index": self.args.index, "cardinality": self.args.cardinality, "window_end": window_end,
+            },
+        }
+
+    def warm_start(self):
+        #médoïdes précédents ramenés dans l'univers de cette fenetre, None si départ à froid
+        if getattr(self.args, "warm_start", "none") == "none" or self.previous_selection is None:
+            return None
+        return self.previous_selection.map_to(self.window.permnos)
+
+    def keep_selection(self, obj):
+        self.selection = Selection.from_solve(self.window.permnos, obj.idx, obj.D)
+
     def quob(self):
         obj = QUOB(
             self.new_return,
             self.new_index,
-            self.universe.args.cardinality,
-            num_cores_per_controller=self.universe.args.replicator_cores,
-            time_limit=self.universe.args.time_limit,
-            distance_method=self.universe.args.distance_method,
+            self.args.cardinality,
+            num_cores_per_controller=self.args.replicator_cores,
+            time_limit=self.args.time_limit,
+            distance_method=self.args.distance_method,
+            dcor_engine=self.args.dcor_engine,
+            dcor_workers=self.args.dcor_workers,
+            corr_matrix=self.correlation_matrix if self.args.distance_method == 'pearson' else None,
+            distance_cache=self.distance_cache,
+            distance_key=self.distance_key(self.args.distance_method == 'pearson'),
+            dist_format=self.args.dist_format,
+            adjacency=self.args.adjacency,
+            adjacency_k=self.args.adjacency_k,
+            workdir_root=self.args.workdir_root,
+            keep_artifacts=self.args.keep_artifacts,
+            scheduler=self.scheduler,
+            **self.replicator_options('quob'),
+            warm_start=self.warm_start(),
+            warm_start_only=self.args.warm_start == 'only',
+            warm_swaps=self.args.warm_swaps,
+            warm_time_fraction=self.args.warm_time_fraction,
+            backend=self.args.quob_backend,
+            polish_seconds=self.args.polish_seconds,
         )
-        return obj.get_weights()
+        weights = obj.get_weights()
+        self.keep_selection(obj)
+        return weights
 
     def quob_cor(self):
         obj = QUOB(
             self.new_return,
             self.new_index,
-            self.universe.args.cardinality,
+            self.args.cardinality,
             simple_corr=True,
-            num_cores_per_controller=self.universe.args.replicator_cores,
-            time_limit=self.universe.args.time_limit,
-            distance_method=self.universe.args.distance_method,
+            num_cores_per_controller=self.args.replicator_cores,
+            time_limit=self.args.time_limit,
+            distance_method=self.args.distance_method,
+            dcor_engine=self.args.dcor_engine,
+            dcor_workers=self.args.dcor_workers,
+            corr_matrix=self.correlation_matrix,
+            distance_cache=self.distance_cache,
+            distance_key=self.distance_key(True),
+            dist_format=self.args.dist_format,
+            adjacency=self.args.adjacency,
+            adjacency_k=self.args.adjacency_k,
+            workdir_root=self.args.workdir_root,
+            keep_artifacts=self.args.keep_artifacts,
+            scheduler=self.scheduler,
+            **self.replicator_options('quob_cor'),
+            warm_start=self.warm_start(),
+            warm_start_only=self.args.warm_start == 'only',
+            warm_swaps=self.args.warm_swaps,
+            warm_time_fraction=self.args.warm_time_fraction,
+            backend=self.args.quob_backend,
+            polish_seconds=self.args.polish_seconds,
+        )
+        weights = obj.get_weights()
+        self.keep_selection(obj)
+        return weights
+
+    def kmedoids(self):
+        pearson = self.args.distance_method == 'pearson'
+        obj = KMedoids(
+            self.new_return,
+            self.new_index,
+            self.args.cardinality,
+            distance_method=self.args.distance_method,
+            dcor_engine=self.args.dcor_engine,
+            dcor_workers=self.args.dcor_workers,
+            corr_matrix=self.correlation_matrix if pearson else None,
+            distance_cache=self.distance_cache,
+            distance_key=self.distance_key(pearson),
+            warm_start=self.warm_start(),
         )
-        return obj.get_weights()
+        weights = obj.get_weights()
+        self.keep_selection(obj)
+        return weights
 
     def gurobi(self):
         obj = Gurobi(
             self.new_return,
             self.new_index,
-            self.universe.args.cardinality,
-            simple_corr=self.universe.args.distance_method == 'pearson',
-            time_limit=self.universe.args.time_limit,
+            self.args.cardinality,
+            simple_corr=self.args.distance_method == 'pearson',
+            time_limit=self.args.time_limit,
+            threads=self.args.gurobi_threads,
+            dcor_engine=self.args.dcor_engine,
+            dcor_workers=self.args.dcor_workers,
+            corr_matrix=self.correlation_matrix if self.args.distance_method == 'pearson' else None,
+            distance_cache=self.distance_cache,
+            #Gurobi laisse les NaN de dcor tels quels, QUOB et KMedoids les remplacent par 1 : entrées distinctes
+            distance_key=self.distance_key(self.args.distance_method == 'pearson',
+                                           nan='one' if self.args.distance_method == 'pearson' else 'keep'),
+            warm_start=self.warm_start(),
+            polish_seconds=self.args.polish_seconds,
+            convexify=self.args.gurobi_convexify,
+            model=self.args.gurobi_model,
+            knn=self.args.gurobi_knn,
+            session=self.gurobi_session,
+            **self.gurobi_trace_options('gurobi'),
         )
-        return obj.get_weights()
+        weights = obj.get_weights()
+        self.keep_selection(obj)
+        return weights
 
     def gurobi_cor(self):
         obj = Gurobi(
             self.new_return,
             self.new_index,
-            self.universe.args.cardinality,
+            self.args.cardinality,
             simple_corr=True,
-            time_limit=self.universe.args.time_limit,
+            time_limit=self.args.time_limit,
+            threads=self.args.gurobi_threads,
+            dcor_engine=self.args.dcor_engine,
+            dcor_workers=self.args.dcor_workers,
+            corr_matrix=self.correlation_matrix,
+            distance_cache=self.distance_cache,
+            distance_key=self.distance_key(True),
+            warm_start=self.warm_start(),
+            polish_seconds=self.args.polish_seconds,
+            convexify=self.args.gurobi_convexify,
+            model=self.args.gurobi_model,
+            knn=self.args.gurobi_knn,
+            session=self.gurobi_session,
+            **self.gurobi_trace_options('gurobi_cor'),
         )
-        return obj.get_weights()
+        weights = obj.get_weights()
+        self.keep_selection(obj)
+        return weights
 
     def lagrange_partial_forward(
         self
@@ -320,8 +620,7 @@ class Solution:
         initial_weight /= initial_weight.sum()  
         bounds = [(0, 1) for _ in range(K)]
         # Define Largest Return data
-        df_new_return = self.universe.df_return[largest_stocks]
-        new_return = np.array(df_new_return)
+        new_return = self.new_return[:, self.stock_list.get_indexer(largest_stocks)]
         # Define Objective & Constratins & Problem
         objective = lambda weight: np.sum((new_return @ weight - new_index)**2)
         constraint = {'type': 'eq', 'fun': self.weight_sum_constraint}#, 'jac': self.weight_sum_jac}
@@ -423,6 +722,8 @@ class Solution:
             weights = self.gurobi()
         elif solution_name == 'gurobi_cor':
             weights = self.gurobi_cor()
+        elif solution_name == 'kmedoids':
+            weights = self.kmedoids()
         elif solution_name == 'lagrange_forward':
             weights = self.lagrange_partial_forward()
         elif solution_name == 'lagrange_backward':
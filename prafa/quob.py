@@ -1,91 +1,137 @@
-import dcor
 import numpy as np
 import pandas as pd
-from scipy.optimize import minimize
-import subprocess
+import shutil
+import tempfile
 from pathlib import Path
 
+from prafa.distance import dcor_distance_matrix, pearson_distance_matrix
+from prafa.distance_cache import DistanceCache
+from prafa.replicator_io import knn_edges, link_complete_adjacency, write_adjacency_matrix, write_distance_matrix
+from prafa.replicator_runner import StallPolicy, run_replicator
+from prafa.tempering import run_params
+from prafa.warm_start import Objective, polish, selection_cost, swap_refine
+from prafa.weights import tracking_weights
+
+
+#racine par défaut des dossiers de travail de ReplicaTOR (un sous-dossier par solve)
+DEFAULT_WORKDIR_ROOT = Path(__file__).resolve().parent / "dist_matrix"
+
+#poids de l'énergie écrits dans le fichier params ; warm start et polissage comparent les sélections avec les memes
+B_SCALE_FACTOR = 0.0333
+D_SCALE_FACTOR = 1.0
 
 
 class QUOB:
-    def __init__(self, stocks_returns, index_returns, K, simple_corr=False, num_cores_per_controller=1, time_limit=300, distance_method='dcor'):
+    def __init__(self, stocks_returns, index_returns, K, simple_corr=False, num_cores_per_controller=1, time_limit=300, distance_method='dcor',
+                 dcor_engine='blas', dcor_workers=1, corr_matrix=None, distance_cache=None, distance_key=None,
+                 dist_format='text', adjacency='complete', adjacency_k=20, workdir_root=None, keep_artifacts=False,
+                 scheduler=None, trace_path=None, stall=None, cost_pattern=None, warm_start=None, warm_start_only=False, warm_swaps=1000, warm_time_fraction=0.25,
+                 backend='replicator', polish_seconds=0):
+        if dist_format == 'binary' and backend != 'numpy':
+            #ReplicaTOR ne lit que le texte : un fichier binaire y serait lu comme une matrice texte fausse
+            raise ValueError("dist_format='binary' is only read by backend='numpy'; ReplicaTOR reads text matrices")
+        if adjacency == 'knn' and backend == 'numpy':
+            #prafa.tempering résout toujours le graphe complet et ne lit pas le fichier d'adjacence
+            raise ValueError("adjacency='knn' needs backend='replicator'; the NumPy backend always solves the complete graph")
         #matrice et vecteur numpy
         self.stocks_returns = stocks_returns
         self.index_returns = index_returns
         self.K = K #cardinalité!!
         self.num_cores_per_controller = num_cores_per_controller
         self.time_limit = time_limit
+        self.dcor_engine = dcor_engine #'blas' (produits matriciels) ou 'fast' (O(T log T), processus)
+        self.dcor_workers = dcor_workers
+        self.corr_matrix = corr_matrix #corrélation des totaux X^T X glissants, ou fonction qui l'assemble (appelée seulement si la distance manque au cache), sinon np.corrcoef
+        self.distance_cache = distance_cache #DistanceCache partagé avec Gurobi, None -> toujours recalculer
+        self.distance_key = distance_key
+        self.dist_format = dist_format #'text' (ReplicaTOR) ou 'binary' (en-tete + float32, backend numpy seulement, voir replicator_io)
+        self.adjacency = adjacency #'complete' (fichier en cache par n) ou 'knn' (matrice 0/1 des k plus proches voisins)
+        self.adjacency_k = adjacency_k
         self.idx = None #liste d'indice des stonks choisit
-        self.dist_dir = Path(__file__).resolve().parent / "dist_matrix"
-        self.dist_dir.mkdir(parents=True, exist_ok=True)
+        self.scheduler = scheduler #ReplicatorScheduler partagé (coeurs en puissance de 2, affinité), None -> subprocess.run
+        if scheduler is not None:
+            #le fichier params doit annoncer le nombre de coeurs réellement attribués
+            self.num_cores_per_controller = scheduler.allotment(num_cores_per_controller)
+        self.trace_path = trace_path #CSV (secondes, round, meilleur coût) écrit pendant le solve, None -> pas de trace
+        self.stall = stall or StallPolicy() #arret anticipé quand le coût stagne (désactivé par défaut)
+        self.cost_pattern = cost_pattern #expression des lignes de progression de ReplicaTOR, None -> PROGRESS_PATTERN
+        self.warm_start = warm_start #médoïdes du rebalancement précédent (indices dans cet univers), None -> départ à froid
+        self.warm_start_only = warm_start_only #True -> raffinement par échanges seulement, sans ReplicaTOR
+        self.warm_swaps = warm_swaps
+        self.warm_time_fraction = warm_time_fraction #part de time_limit laissée à ReplicaTOR quand il part d'une sélection chaude
+        self.polish_seconds = polish_seconds #budget des échanges après ReplicaTOR, 0 -> pas de polissage
+        self.backend = backend #'replicator' (binaire ReplicaTOR) ou 'numpy' (prafa.tempering, meme fichier params)
+        self.solver_name = 'ReplicaTOR' if backend == 'replicator' else 'NumPy tempering' #pour les messages
+        self.keep_artifacts = keep_artifacts #garder le dossier de travail après le solve (débogage)
+        self.objective = Objective.quob(B_SCALE_FACTOR, D_SCALE_FACTOR) #énergie que ReplicaTOR minimise
+
+        #dossier de travail propre à ce solve, plusieurs QUOB peuvent tourner en meme temps
+        self.workdir_root = Path(workdir_root) if workdir_root else DEFAULT_WORKDIR_ROOT
+        self.workdir_root.mkdir(parents=True, exist_ok=True)
 
         #construire ma matrice de distance
-        if simple_corr or distance_method == 'pearson':
-            self.matrix_simplecor()
-        else:
-            self.matrix_dcor()
+        D = self.distance_matrix(simple_corr or distance_method == 'pearson')
+        self.D = D
+
+        #le dossier n'est créé qu'une fois D calculée, et supprimé si l'écriture des fichiers échoue
+        self.dist_dir = Path(tempfile.mkdtemp(prefix="quob_", dir=self.workdir_root))
+        try:
+            #avec n <= K, select() rend tous les titres sans lancer de solveur
+            if (warm_start is None or not warm_start_only) and D.shape[0] > K:
+                write_distance_matrix(self.dist_dir / "dist_matrix.d", D, self.dist_format)
+                self.write_adjacency(D)
+        except BaseException:
+            if self.keep_artifacts:
+                print(f"⚠️ QUOB setup failed; artifacts kept in {self.dist_dir}")
+            self.cleanup()
+            raise
         
 
 
-    def matrix_dcor(self):
-        
-        Welsch_function = lambda x : 1 - np.exp(-0.5 * x)
-
-        n = self.stocks_returns.shape[1]
-        dcor_mat = np.zeros((n, n))
-        
-        for i in range(n):
-            for j in range(i, n):
-                dcor_val = dcor.distance_correlation(self.stocks_returns[:, i], self.stocks_returns[:, j])
-                dist = 1 - dcor_val
-                dcor_mat[i, j] = dcor_mat[j, i] = Welsch_function(dist) #Welsch_function(dist)
-    
-        safe_dcor = np.nan_to_num(dcor_mat, nan=1.0, posinf=1.0, neginf=1.0)
-
-        np.savetxt(self.dist_dir / "dist_matrix.d", safe_dcor)
-        np.savetxt(self.dist_dir / "dist_matrix.adj", np.ones((n, n), dtype=int) - np.eye(n, dtype=int), fmt="%d")
-        
-
-
-    def matrix_simplecor(self):
-        distance_func = lambda di : np.sqrt(0.5*(1 - di))
-        Welsch_function = lambda x : 1 - np.exp(-0.5 * x)
+    def write_adjacency(self, D):
+        n = D.shape[0]
+        adj_path = self.dist_dir / "dist_matrix.adj"
+        if self.adjacency == 'knn':
+            #graphe des k plus proches voisins, en matrice 0/1 dense comme le graphe complet
+            rows, cols = knn_edges(D, self.adjacency_k)
+            write_adjacency_matrix(adj_path, n, rows, cols)
+        else:
+            #le graphe complet ne dépend que de n : écrit une fois, puis lien dur (les dernières tailles restent en cache)
+            link_complete_adjacency(self.workdir_root / "adjacency", n, adj_path)
 
-        n = self.stocks_returns.shape[1]
 
-        # Replace NaN/inf returns before computing correlations to avoid
-        # runtime warnings from zero-variance slices; the downstream
-        # nan_to_num keeps the distances well-defined.
-        cleaned_returns = np.nan_to_num(
-            self.stocks_returns, nan=0.0, posinf=0.0, neginf=0.0
+    def distance_matrix(self, pearson):
+        return DistanceCache.get_or_compute(
+            self.distance_cache, self.distance_key, self.matrix_simplecor if pearson else self.matrix_dcor
         )
 
-        with np.errstate(invalid="ignore", divide="ignore"):
-            corr_matrix = np.corrcoef(cleaned_returns, rowvar=False)
 
-        distance_matrix = distance_func(corr_matrix)
-        safe_distance = np.nan_to_num(distance_matrix, nan=1.0, posinf=1.0, neginf=1.0)
+    def matrix_dcor(self):
+        #Welsch_function(1 - dcor) sur toutes les paires, moteur choisi par dcor_engine ; NaN/inf remplacés par 1
+        dcor_mat = dcor_distance_matrix(self.stocks_returns, engine=self.dcor_engine, workers=self.dcor_workers)
+        return np.nan_to_num(dcor_mat, nan=1.0, posinf=1.0, neginf=1.0)
+        
 
-        np.savetxt(self.dist_dir / "dist_matrix.d", Welsch_function(safe_distance))
-        np.savetxt(self.dist_dir / "dist_matrix.adj", np.ones((n, n), dtype=int) - np.eye(n, dtype=int), fmt="%d")
+
+    def matrix_simplecor(self):
+        #Welsch_function(sqrt(0.5 * (1 - corr))), rendements NaN/inf remplacés avant la corrélation
+        return pearson_distance_matrix(self.stocks_returns, self.corr_matrix)
 
 
-    def stock_picking(self, n):
+    def stock_picking(self, n, time_limit=None):
         #résolution du probleme d'optimisation 
         #retourne une liste d'indice des stonks sélectionné
-        dist_dir = Path(__file__).resolve().parent / "dist_matrix"
-        dist_dir.mkdir(parents=True, exist_ok=True)
-
+        time_limit = self.time_limit if time_limit is None else time_limit
         param = f"""num_vars {n} #INT number of variables/nodes
                 num_k {self.K} #INT number of medoids/exemplars
-                B_scale_factor {0.0333} 0.5*(self.K+1)/n#FLOAT32 scaling factor for model bias, set to 0.5*(num_k +1)/num_vars
-                D_scale_factor 1.0 #FLOAT32 scaling factor for model distances, leave at 1
+                B_scale_factor {B_SCALE_FACTOR} 0.5*(self.K+1)/n#FLOAT32 scaling factor for model bias, set to 0.5*(num_k +1)/num_vars
+                D_scale_factor {D_SCALE_FACTOR} #FLOAT32 scaling factor for model distances, leave at 1
                 problem_path {self.dist_dir}/
                 problem_name dist_matrix
                 cost_answer -1000000 #FLOAT32 target cost to allow program to exit early if found, set to large neg value if you don't want an early exit
                 T_max 0.01 #FLOAT32 parallel tempering max temperature
                 T_min 0.00001 #FLOAT32 parallel tempering min temperature
-                time_limit {float(self.time_limit)} #FLOAT64 time limit for search in seconds
+                time_limit {float(time_limit)} #FLOAT64 time limit for search in seconds
                 round_limit 100000000 #INT round/iteration limit for search. Search ends if no cost improvement found within a 10000 round window
                 num_replicas_per_controller 32 #INT (POW2 only) number of replicas per parallel tempering controller
                 num_controllers 1 #INT (POW2 only) number of parallel tempering controllers
@@ -97,7 +143,34 @@ class QUOB:
         with params_path.open("w") as f:
             f.write(param)
 
-        replicator_binary = Path.home() / "or_tool/ReplicaTOR/cmake-build/ReplicaTOR"
+        #stdout lu ligne par ligne : trace du meilleur coût (seulement si demandée) et arret si plus d'amélioration
+        trace_path = self.trace_path
+        result = self.run_solver(params_path, trace_path, self.stall)
+        numbers = self.read_solution(result, n)
+        if result.stopped_early and (numbers is None or len(numbers) < self.K):
+            #le comportement de ReplicaTOR sur SIGINT n'est pas garanti : sans solution complète, on relance sans arret anticipé
+            print(f"⚠️ {self.solver_name} left no complete solution after the stall stop; solving again for the full time limit")
+            result = self.run_solver(params_path, trace_path, None)
+            numbers = self.read_solution(result, n)
+
+        if numbers is None or len(numbers) < self.K:
+            soln_path_txt = self.dist_dir / "dist_matrix.soln.txt"
+            stderr = result.stderr.strip()
+            raise FileNotFoundError(
+                f"{self.solver_name} solution file missing or incomplete at {soln_path_txt}.\n"
+                f"Found {len(numbers) if numbers is not None else 0} valid medoids, expected {self.K}.\n"
+                f"Return code: {result.returncode}\n"
+                f"Stdout: {result.stdout or ''}\n"
+                f"Stderr: {stderr}"
+            )
+
+        numbers = numbers[: self.K]
+        (self.dist_dir / "dist_matrix.soln.txt").write_text(" ".join(map(str, numbers)))
+
+        return numbers
+
+
+    def run_solver(self, params_path, trace_path, stall):
         soln_path_txt = self.dist_dir / "dist_matrix.soln.txt"
         soln_path_noext = self.dist_dir / "dist_matrix.soln"
 
@@ -106,26 +179,38 @@ class QUOB:
         soln_path_txt.unlink(missing_ok=True)
         soln_path_noext.unlink(missing_ok=True)
 
-        result = subprocess.run(
-            [str(replicator_binary), str(params_path)],
-            capture_output=True,
-            text=True,
-        )
+        if self.backend == 'numpy':
+            #meme problème résolu en Python, pour les machines sans le binaire ou pour vérifier ses résultats
+            result = run_params(params_path, workers=self.num_cores_per_controller, trace_path=trace_path, stall=stall)
+        elif self.scheduler is not None:
+            #attend que des coeurs se libèrent, plusieurs ReplicaTOR tournent en meme temps
+            result = self.scheduler.submit(params_path, self.num_cores_per_controller, trace_path, stall, self.cost_pattern).result()
+        else:
+            result = run_replicator(params_path, trace_path=trace_path, stall=stall, pattern=self.cost_pattern)
+        if result.stopped_early:
+            print(f"{self.solver_name} stopped after the cost stalled; keeping the incumbent{f' (trace: {trace_path})' if trace_path else ''}")
 
         # Persist stdout for debugging and fallback parsing when no .soln file
         # is produced by ReplicaTOR.
-        stdout = result.stdout or ""
-        (self.dist_dir / "dist_matrix_replicator_stdout.log").write_text(stdout)
+        (self.dist_dir / "dist_matrix_replicator_stdout.log").write_text(result.stdout or "")
 
         if not soln_path_txt.exists() and soln_path_noext.exists():
             soln_path_noext.rename(soln_path_txt)
+        return result
+
+
+    def read_solution(self, result, n):
+        #médoïdes valides du fichier solution, ou du dernier bloc "K Medoid Indices:" de stdout ; None si aucun
+        soln_path_txt = self.dist_dir / "dist_matrix.soln.txt"
+        stdout = result.stdout or ""
 
         def parse_medoids_from_stdout(raw_stdout):
             marker = "K Medoid Indices:"
             if marker not in raw_stdout:
                 return None
 
-            medoid_block = raw_stdout.split(marker, 1)[1]
+            #dernier bloc : la solution finale, ou l'incumbent après un arret anticipé
+            medoid_block = raw_stdout.rsplit(marker, 1)[1]
             # Stop before the cluster assignments section if present.
             for stop_marker in ("Cluster Assignments", "FILE"):
                 if stop_marker in medoid_block:
@@ -148,16 +233,8 @@ class QUOB:
 
         numbers = read_solution_numbers()
 
-        # If the solution file exists but is truncated, rebuild it from stdout.
-        if numbers is not None and len(numbers) != self.K:
-            stdout_medoids = parse_medoids_from_stdout(stdout)
-            if stdout_medoids:
-                cleaned = filter_valid(stdout_medoids)
-                if cleaned:
-                    soln_path_txt.write_text(" ".join(map(str, cleaned[: self.K])))
-                    numbers = cleaned[: self.K]
-
-        if numbers is None:
+        # If the solution file is missing or truncated, rebuild it from stdout.
+        if numbers is None or len(numbers) != self.K:
             stdout_medoids = parse_medoids_from_stdout(stdout)
             if stdout_medoids:
                 cleaned = filter_valid(stdout_medoids)
@@ -167,38 +244,33 @@ class QUOB:
 
         if numbers is not None:
             numbers = filter_valid(numbers)
+        return numbers
 
-        if numbers is None or len(numbers) < self.K:
-            stderr = result.stderr.strip()
-            raise FileNotFoundError(
-                f"ReplicaTOR solution file missing or incomplete at {soln_path_txt}.\n"
-                f"Found {len(numbers) if numbers is not None else 0} valid medoids, expected {self.K}.\n"
-                f"Return code: {result.returncode}\n"
-                f"Stdout: {stdout}\n"
-                f"Stderr: {stderr}"
-            )
 
-        numbers = numbers[: self.K]
-        soln_path_txt.write_text(" ".join(map(str, numbers)))
+    def select(self, n):
+        if n <= self.K:
+            #rien à choisir : tous les titres, sans solveur (le fichier solution n'aurait que n médoïdes)
+            return list(range(n))
 
-        return numbers
+        #départ à froid : ReplicaTOR seul
+        if self.warm_start is None:
+            return self.stock_picking(n)
 
+        #départ à chaud : échanges depuis la sélection précédente, puis le meilleur des deux pour l'énergie de ReplicaTOR
+        warm = swap_refine(self.D, self.warm_start, self.K, max_swaps=self.warm_swaps, objective=self.objective).tolist()
+        if self.warm_start_only:
+            return warm
+        #ReplicaTOR ne lit pas de solution initiale : on lui laisse seulement une part du temps
+        cold = self.stock_picking(n, self.time_limit * self.warm_time_fraction)
+        return min((cold, warm), key=lambda idx: selection_cost(self.D, idx, self.K, self.objective))
 
-    def calc_weights(self):
-        self.idx = self.stock_picking(self.stocks_returns.shape[1])
-        subset_returns = self.stocks_returns[:, self.idx]
-        
-        initial_weight = np.ones(len(self.idx))
-        initial_weight /= initial_weight.sum()  
-        bounds = [(0, 1) for _ in range(len(self.idx))]
 
-        # Define Constraints    
-        constraint = {'type': 'eq', 'fun':lambda weight : np.sum(weight) - 1}
-        objective_function = lambda weight : np.sum((subset_returns @ weight - self.index_returns)**2)
-        
-        # Optimization
-        result = minimize(objective_function, initial_weight, method = 'SLSQP', constraints=constraint, bounds=bounds)
-        return result.x
+    def calc_weights(self):
+        self.idx = self.select(self.stocks_returns.shape[1])
+        if self.polish_seconds > 0:
+            #échanges sur l'énergie de ReplicaTOR, pas sur l'objectif de Gurobi
+            self.idx = polish(self.D, self.idx, self.K, self.polish_seconds, self.objective)
+        return tracking_weights(self.stocks_returns[:, self.idx], self.index_returns)
 
     
     def get_weights(self):
@@ -206,8 +278,21 @@ class QUOB:
         
         weight_global = np.zeros(self.stocks_returns.shape[1])
 
-        micro_weight = self.calc_weights()
+        try:
+            micro_weight = self.calc_weights()
+        except Exception:
+            #les fichiers d'un solve raté restent sur disque pour le débogage
+            print(f"⚠️ QUOB solve failed; artifacts kept in {self.dist_dir}")
+            raise
+        self.cleanup()
+
         for i in range(len(micro_weight)):
             weight_global[self.idx[i]] = micro_weight[i]
 
         return weight_global
+
+
+    def cleanup(self):
+        #supprime le dossier de travail sauf avec keep_artifacts
+        if not self.keep_artifacts:
+            shutil.rmtree(self.dist_dir, ignore_errors=True)
@@ -0,0 +1,311 @@
+"""Core-aware asyncio scheduler for ReplicaTOR processes.
+
+``QUOB.stock_picking`` used to block on ``subprocess.run`` for up to
+``--time_limit`` seconds with one solve at a time.  ``ReplicatorScheduler``
+owns the CPUs this process may use and keeps several ReplicaTOR processes in
+flight: each job gets a power-of-two number of cores (``num_cores_per_controller``
+must be a power of two), and waits until enough cores are free (a smaller job
+may start ahead of a larger one that is still waiting).  The job is started as
+``taskset --cpu-list <cpus> ReplicaTOR <params>``, so the affinity is set
+before ReplicaTOR execs and every thread it starts inherits it; ``taskset``
+execs in place, so the pid (and SIGINT) is still ReplicaTOR's.  Without
+``taskset``, ``sched_setaffinity`` on the child's pid right after spawning is
+the fallback (``preexec_fn`` is not safe in a process with threads, which the
+scheduler's own loop makes this one); it only pins the main thread, so
+threads started before that call keep the full CPU set.  On a 64-core node, eight 8-core windows
+run at once.
+
+The asyncio loop runs in a background thread, so ``submit`` can be called from
+ordinary (threaded) code and returns a ``concurrent.futures.Future``; asyncio
+code can await ``run`` directly on the scheduler's loop.  ``close`` stops the loop; the
+owner calls it once the backtest is done.
+
+``stream_replicator`` reads ReplicaTOR's stdout line by line while it runs
+(with a ``STREAM_LIMIT`` buffer: the medoid and cluster-assignment lines of a
+large problem are far longer than asyncio's 64 KiB default).  Progress lines
+feed a ``CostMonitor`` through a regular expression with a ``cost`` group and
+an optional ``round`` group; every improvement is appended to a CSV trace
+(elapsed seconds, round, best cost).  The default, ``PROGRESS_PATTERN``,
+matches ``round <N> best cost: <X>``, the format ``prafa.tempering`` prints.
+It has not been checked against a given ReplicaTOR release, whose progress
+output may differ: ``--cost_pattern`` sets the expression for the build in
+use.  A line that does not match is ignored, so a mismatch leaves the trace
+empty and the stall stop inactive, whose clock starts at the first matching
+line.  QUOB only passes a trace path when ``--cost_trace_dir`` is set, and
+``main.py`` disables ``--stall_seconds``/``--stall_rounds`` on the ReplicaTOR
+backend unless ``--cost_pattern`` is given; ``stream_replicator`` then prints
+its no-match warning only when a trace or a stall stop was explicitly asked
+for.  The default deliberately requires ``best cost:``, so an echoed setting
+such as ``cost_answer -1000000`` is never taken for an incumbent.
+
+With a ``StallPolicy``, a run whose best cost has not improved for ``seconds``
+seconds or ``rounds`` rounds receives SIGINT, then SIGKILL after ``grace``
+seconds, and the result is flagged ``stopped_early``.  Whether ReplicaTOR
+prints or writes its incumbent on SIGINT is likewise unconfirmed.  QUOB reads
+the last ``K Medoid Indices:`` block it finds, and when a stopped run left no
+complete solution it runs the problem again without the stall stop.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import shutil
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+DEFAULT_REPLICATOR_BINARY = Path.home() / "or_tool/ReplicaTOR/cmake-build/ReplicaTOR"
+
+
+def available_cpus() -> list:
+    #CPUs autorisés pour ce processus (respecte taskset/cgroups), sinon tous
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def power_of_two_cores(requested: int, available: int) -> int:
+    """Largest power of two not above ``requested`` nor ``available`` (at least 1)."""
+
+    return 1 << (max(1, min(requested, available)).bit_length() - 1)
+
+
+#ligne de progression "round <N> best cost: <X>" (format de prafa.tempering, --cost_pattern pour un autre build de ReplicaTOR)
+PROGRESS_PATTERN = r"(?i)^\s*round\s+(?P<round>\d+)\s+best cost:\s*(?P<cost>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$"
+
+
+def compile_progress_pattern(pattern: str = None) -> re.Pattern:
+    """Compiled progress pattern; it needs a ``cost`` group, a ``round`` group is optional."""
+
+    compiled = re.compile(PROGRESS_PATTERN if pattern is None else pattern)
+    if "cost" not in compiled.groupindex:
+        raise ValueError(f"cost pattern {compiled.pattern!r} has no (?P<cost>...) group")
+    return compiled
+
+#taille maximale d'une ligne de stdout (la limite par défaut d'asyncio, 64 Kio, est dépassée par les grands problèmes)
+STREAM_LIMIT = 1 << 26
+
+
+@dataclass(frozen=True)
+class ReplicatorResult:
+    #memes attributs que subprocess.CompletedProcess pour le parsing de QUOB
+    returncode: int
+    stdout: str
+    stderr: str
+    cpus: tuple = ()
+    stopped_early: bool = False
+
+
+@dataclass(frozen=True)
+class StallPolicy:
+    """Stop a run whose best cost has not improved for ``seconds`` seconds or ``rounds`` rounds."""
+
+    seconds: float = None
+    rounds: int = None
+    grace: float = 10.0  #secondes entre SIGINT et SIGKILL
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.seconds) or bool(self.rounds)
+
+
+class CostMonitor:
+    def __init__(self, stall: StallPolicy = None, pattern: str = None):
+        self.stall = stall or StallPolicy()
+        self.pattern = compile_progress_pattern(pattern)
+        self.start = time.monotonic()
+        self.best = None
+        self.best_time = None
+        self.best_round = None
+        self.round = None
+
+    def observe(self, line: str) -> bool:
+        """Parse one stdout line; True when it reports a new best cost."""
+
+        match = self.pattern.search(line)
+        if match is None:
+            return False
+        groups = match.groupdict()
+        if groups.get("round") is not None:
+            self.round = int(groups["round"])
+        if groups["cost"] is None:
+            #ligne qui ne donne que le numéro de round
+            return False
+        cost = float(groups["cost"])
+        if self.best is not None and cost >= self.best:
+            return False
+        self.best = cost
+        self.best_time = time.monotonic()
+        self.best_round = self.round
+        return True
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def time_left(self):
+        #None tant qu'aucun coût n'a été vu : pas de délai de lecture
+        if not self.stall.seconds or self.best is None:
+            return None
+        return max(0.0, self.best_time + self.stall.seconds - time.monotonic())
+
+    def stalled(self) -> bool:
+        if self.best is None:
+            return False
+        if self.stall.seconds and time.monotonic() - self.best_time >= self.stall.seconds:
+            return True
+        if self.stall.rounds and self.round is not None and self.best_round is not None:
+            return self.round - self.best_round >= self.stall.rounds
+        return False
+
+
+async def _kill_after(process, grace: float) -> None:
+    await asyncio.sleep(grace)
+    if process.returncode is None:
+        process.kill()
+
+
+async def stream_replicator(command, trace_path=None, stall: StallPolicy = None, on_start=None,
+                            pattern: str = None) -> ReplicatorResult:
+    """Run ``command``, parsing its stdout line by line; see the module docstring.
+
+    ``on_start(process)`` is called once the process exists, before any output is read.
+    ``pattern`` is the progress regular expression (``PROGRESS_PATTERN`` when None).
+    """
+
+    process = await asyncio.create_subprocess_exec(
+        *map(str, command),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=STREAM_LIMIT,
+    )
+    if on_start is not None:
+        on_start(process)
+    stderr_task = asyncio.ensure_future(process.stderr.read())
+    monitor = CostMonitor(stall, pattern)
+    lines = []
+    stopped = False
+    killer = None
+
+    trace = open(trace_path, "w") if trace_path else None
+    try:
+        if trace:
+            trace.write("elapsed_seconds,round,best_cost\n")
+        while True:
+            try:
+                raw = await asyncio.wait_for(process.stdout.readline(), None if stopped else monitor.time_left())
+            except asyncio.TimeoutError:
+                raw = None
+            if raw == b"":
+                break
+            if raw is not None:
+                line = raw.decode(errors="replace")
+                lines.append(line)
+                if monitor.observe(line) and trace:
+                    round_ = "" if monitor.round is None else monitor.round
+                    trace.write(f"{monitor.elapsed():.3f},{round_},{monitor.best!r}\n")
+                    trace.flush()
+            if not stopped and monitor.stall.enabled and monitor.stalled():
+                #plus d'amélioration : ReplicaTOR s'arrete sur SIGINT en gardant sa meilleure solution
+                stopped = True
+                process.send_signal(signal.SIGINT)
+                killer = asyncio.ensure_future(_kill_after(process, monitor.stall.grace))
+    finally:
+        if trace:
+            trace.close()
+
+    await process.wait()
+    if killer is not None:
+        killer.cancel()
+    if monitor.best is None and (trace_path or monitor.stall.enabled):
+        #aucune ligne reconnue : la trace est vide et l'arret anticipé n'a rien pu faire
+        print(
+            f"⚠️ No ReplicaTOR output line matched the cost pattern {monitor.pattern.pattern!r}: "
+            f"the cost trace is empty{' and the stall stop never applied' if monitor.stall.enabled else ''}. "
+            f"Set --cost_pattern to the progress format of this ReplicaTOR build."
+        )
+    stderr = await stderr_task
+    return ReplicatorResult(process.returncode, "".join(lines), stderr.decode(errors="replace"), stopped_early=stopped)
+
+
+def run_replicator(params_path, binary=DEFAULT_REPLICATOR_BINARY, trace_path=None, stall: StallPolicy = None,
+                   pattern: str = None) -> ReplicatorResult:
+    """Blocking single run of ReplicaTOR with streamed stdout (no scheduler)."""
+
+    return asyncio.run(stream_replicator([binary, params_path], trace_path, stall, pattern=pattern))
+
+
+def pinned_command(command, cpus):
+    """(command, on_start) running ``command`` on ``cpus``: through taskset, or pinned after spawning without it."""
+
+    if shutil.which("taskset"):
+        #affinité fixée avant l'exec : tous les threads de ReplicaTOR en héritent
+        return ["taskset", "--cpu-list", ",".join(map(str, cpus)), *command], None
+    return list(command), lambda process: pin_cpus(process, cpus)
+
+
+def pin_cpus(process, cpus) -> None:
+    #repli sans taskset, après le fork sur le pid du processus (preexec_fn n'est pas sûr avec des threads) :
+    #seul le thread principal est épinglé, les threads déjà créés gardent tous les CPUs
+    if not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        os.sched_setaffinity(process.pid, cpus)
+    except ProcessLookupError:
+        #déjà terminé (erreur de lancement) : rien à épingler
+        pass
+
+
+class ReplicatorScheduler:
+    def __init__(self, binary=DEFAULT_REPLICATOR_BINARY, cpus=None):
+        self.binary = Path(binary)
+        self.cpus = sorted(cpus) if cpus is not None else available_cpus()
+        self._free = list(self.cpus)
+        self._released = None  #asyncio.Condition, créée dans la boucle
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="replicator-scheduler", daemon=True)
+        self._thread.start()
+
+    def allotment(self, requested: int) -> int:
+        """Cores a job asking for ``requested`` will get; write this value in its params file."""
+
+        return power_of_two_cores(requested, len(self.cpus))
+
+    async def _acquire(self, count: int) -> tuple:
+        if self._released is None:
+            self._released = asyncio.Condition()
+        async with self._released:
+            await self._released.wait_for(lambda: len(self._free) >= count)
+            #les plus petits identifiants libres, souvent contigus sur un meme socket
+            cpus, self._free = tuple(self._free[:count]), self._free[count:]
+        return cpus
+
+    async def _release(self, cpus: tuple) -> None:
+        async with self._released:
+            self._free = sorted(self._free + list(cpus))
+            self._released.notify_all()
+
+    async def run(self, params_path, cores: int, trace_path=None, stall: StallPolicy = None,
+                  pattern: str = None) -> ReplicatorResult:
+        """Run ReplicaTOR on ``params_path`` once ``allotment(cores)`` CPUs are free."""
+
+        cpus = await self._acquire(self.allotment(cores))
+        try:
+            command, on_start = pinned_command([self.binary, params_path], cpus)
+            result = await stream_replicator(command, trace_path, stall, on_start=on_start, pattern=pattern)
+        finally:
+            await self._release(cpus)
+        return ReplicatorResult(result.returncode, result.stdout, result.stderr, cpus, result.stopped_early)
+
+    def submit(self, params_path, cores: int, trace_path=None, stall: StallPolicy = None, pattern: str = None):
+        """Queue a ReplicaTOR run from any thread; returns a ``concurrent.futures.Future``."""
+
+        return asyncio.run_coroutine_threadsafe(self.run(params_path, cores, trace_path, stall, pattern), self.loop)
+
+    def close(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
@@ -0,0 +1,187 @@
+"""Binary columnar store for the wide return files.
+
+``returns_stocks.csv`` holds one column per permno and one row per trading day.
+Parsing it with ``pd.read_csv`` followed by a ``pd.to_datetime`` pass dominates
+the start-up time of ``main.py`` and ``scripts/analyze_results.py``.  This
+module converts a CSV once into three NumPy files sitting next to it::
+
+    returns_stocks.npy          float64 matrix (dates x permnos)
+    returns_stocks.dates.npy    datetime64[ns] row labels
+    returns_stocks.columns.npy  permno labels (unicode strings)
+
+``load_returns`` reads the binary files when they exist and are at least as
+recent as the CSV, and falls back to the CSV otherwise.  ``ReturnsMatrix``
+memory-maps the same files so that training windows are integer slices and
+column gathers, and several processes reading the same store share the OS page
+cache instead of each holding a private copy.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def store_paths(csv_path) -> dict:
+    #chemins des fichiers binaires associés à un csv
+    csv_path = Path(csv_path)
+    stem = csv_path.with_suffix("")
+    return {
+        "values": stem.with_suffix(".npy"),
+        "dates": Path(f"{stem}.dates.npy"),
+        "columns": Path(f"{stem}.columns.npy"),
+    }
+
+
+def store_is_fresh(csv_path) -> bool:
+    """Return True when the binary store exists and is not older than the CSV."""
+
+    csv_path = Path(csv_path)
+    paths = store_paths(csv_path)
+    if not all(path.exists() for path in paths.values()):
+        return False
+    if not csv_path.exists():
+        return True
+    store_mtime = min(path.stat().st_mtime for path in paths.values())
+    return store_mtime >= csv_path.stat().st_mtime
+
+
+def read_returns_csv(csv_path, date_column: str, usecols=None) -> pd.DataFrame:
+    df = pd.read_csv(csv_path, usecols=usecols)
+    df[date_column] = pd.to_datetime(df[date_column])
+    df.set_index(date_column, inplace=True)
+    return df
+
+
+def convert_csv(csv_path, date_column: str = "date") -> dict:
+    """Parse ``csv_path`` once and write its binary store. Returns the written paths."""
+
+    csv_path = Path(csv_path)
+    df = read_returns_csv(csv_path, date_column)
+    paths = store_paths(csv_path)
+
+    np.save(paths["values"], df.to_numpy(dtype=np.float64))
+    np.save(paths["dates"], df.index.to_numpy(dtype="datetime64[ns]"))
+    np.save(paths["columns"], np.asarray([str(col) for col in df.columns], dtype=np.str_))
+    return paths
+
+
+def load_store(csv_path, date_column: str = "date") -> pd.DataFrame:
+    paths = store_paths(csv_path)
+    values = np.load(paths["values"])
+    dates = pd.DatetimeIndex(np.load(paths["dates"]), name=date_column)
+    columns = pd.Index(np.load(paths["columns"]).astype(str).tolist(), dtype=object)
+    return pd.DataFrame(values, index=dates, columns=columns, copy=False)
+
+
+def load_returns(csv_path, date_column: str = "date") -> pd.DataFrame:
+    """Load a wide return file, preferring its binary store over the CSV."""
+
+    if store_is_fresh(csv_path):
+        return load_store(csv_path, date_column)
+
+    if any(path.exists() for path in store_paths(csv_path).values()):
+        print(f"⚠️ Binary store for {csv_path} is missing or older than the CSV; reading the CSV instead.")
+    return read_returns_csv(csv_path, date_column)
+
+
+class ReturnsMatrix:
+    """Read-only (dates x permnos) return matrix with integer row/column indexes.
+
+    ``values`` is a ``np.memmap`` when the binary store is available and an
+    in-memory array parsed from the CSV otherwise.  Rows are sorted by date, so
+    date ranges resolve to a contiguous row slice with ``searchsorted``; permnos
+    resolve to column positions through a precomputed dictionary.
+    """
+
+    def __init__(self, values, dates, columns, path=None):
+        self.values = values
+        self.dates = pd.DatetimeIndex(dates, name="date")
+        self.columns = pd.Index([str(col) for col in columns], dtype=object)
+        self.path = path
+        self._dates64 = self.dates.to_numpy(dtype="datetime64[ns]")
+        self.column_of = {permno: j for j, permno in enumerate(self.columns)}
+
+    @classmethod
+    def open(cls, csv_path, date_column: str = "date", permnos=None, start=None, end=None) -> "ReturnsMatrix":
+        """Open the returns of ``csv_path``.
+
+        Without ``permnos``/``start``/``end`` the binary store is memory-mapped
+        as a whole.  With them, only those columns and the rows dated in
+        [start, end] are kept in memory: the CSV is parsed with ``usecols`` and
+        the binary store is gathered once from its memory map.
+        """
+
+        pruned = permnos is not None or start is not None or end is not None
+        if store_is_fresh(csv_path):
+            paths = store_paths(csv_path)
+            matrix = cls(
+                np.load(paths["values"], mmap_mode="r"),
+                np.load(paths["dates"]),
+                np.load(paths["columns"]).astype(str),
+                path=Path(csv_path),
+            )
+            return matrix.subset(permnos, start, end) if pruned else matrix
+
+        usecols = None
+        if permnos is not None:
+            wanted = {str(p) for p in permnos}
+            header = pd.read_csv(csv_path, nrows=0).columns
+            usecols = [col for col in header if col == date_column or col in wanted]
+
+        df = read_returns_csv(csv_path, date_column, usecols=usecols)
+        if start is not None or end is not None:
+            df = df.loc[start:end]
+        return cls(df.to_numpy(dtype=np.float64), df.index, df.columns)
+
+    def __reduce__(self):
+        #un store mappé est ré-ouvert par chemin plutôt que copié lors du pickling
+        if self.path is not None:
+            return (type(self).open, (self.path,))
+        return (type(self), (np.asarray(self.values), self.dates, self.columns))
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def row_slice(self, start, end) -> slice:
+        """Rows whose date lies in [start, end], both inclusive like ``.loc``."""
+
+        start = np.datetime64(pd.Timestamp(start), "ns")
+        end = np.datetime64(pd.Timestamp(end), "ns")
+        return slice(
+            int(np.searchsorted(self._dates64, start, side="left")),
+            int(np.searchsorted(self._dates64, end, side="right")),
+        )
+
+    def column_positions(self, permnos) -> np.ndarray:
+        """Column positions of ``permnos``; unknown permnos map to -1."""
+
+        return np.fromiter((self.column_of.get(str(p), -1) for p in permnos), dtype=np.intp)
+
+    def window(self, rows: slice, columns: np.ndarray) -> np.ndarray:
+        """Gather ``values[rows, columns]`` into a fresh array with NaN set to 0."""
+
+        #l'indexation par liste d'entiers copie déjà la fenetre hors du mmap
+        block = np.asarray(self.values[rows][:, np.asarray(columns, dtype=np.intp)], dtype=np.float64)
+        block[np.isnan(block)] = 0.0
+        return block
+
+    def subset(self, permnos=None, start=None, end=None) -> "ReturnsMatrix":
+        """In-memory copy restricted to ``permnos`` and the rows dated in [start, end]."""
+
+        rows = self.row_slice(
+            self.dates[0] if start is None else start,
+            self.dates[-1] if end is None else end,
+        )
+        if permnos is None:
+            columns = np.arange(self.shape[1])
+        else:
+            positions = self.column_positions(permnos)
+            columns = np.unique(positions[positions >= 0])
+        values = np.ascontiguousarray(self.values[rows][:, columns], dtype=np.float64)
+        return type(self)(values, self.dates[rows], self.columns[columns])
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.values, index=self.dates, columns=self.columns, copy=False)
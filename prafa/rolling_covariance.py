@@ -0,0 +1,150 @@
+"""Running sufficient statistics for assembling Pearson correlation matrices.
+
+Consecutive training windows overlap heavily (with ``--T 3`` and monthly
+rebalancing all but two months of the days are shared), yet ``np.corrcoef``
+recomputes the full T x n^2 product every time.  ``RollingCovariance`` keeps,
+over a fixed set of columns (the permnos of the whole run, NaN set to 0 as in
+``Universe.window``), the running totals of the last window it assembled::
+
+    cross   X^T X               (m x m)
+    sums    sum of returns      (m,)
+    count   number of days
+
+and moves them to the next window by subtracting the rows that leave it and
+adding the rows that enter it.  A window's correlation matrix is then gathered
+from those totals.
+
+Updating costs (rows leaving + rows entering) x m^2 against T x n^2 for
+``np.corrcoef`` on the window's n columns.  The totals are only updated when
+that is cheaper (short rebalancing steps); otherwise ``correlation`` returns
+None and the caller falls back to ``np.corrcoef``.  The totals are first built
+(T x m^2) on a window whose step from the previous one was short enough, so
+the first window and long steps never pay for them.  ``m`` should stay close
+to ``n``: build the totals on the run's members rather than on every column of
+a long-history return file.
+
+A pickled copy (``--workers``) carries neither the returns nor the totals:
+each worker job sees a single window, where assembling never pays off.
+
+Nothing is kept on disk: the totals live for one run and only help
+consecutive windows of that run.  Yearly rebalancing, sweeps over ``--T``
+and repeated runs get nothing from it; repeated runs are served by the
+distance-matrix cache (``prafa.distance_cache``).
+"""
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+from scipy.linalg.blas import dgemm
+
+from prafa.returns_store import ReturnsMatrix
+
+#cout du regroupement (np.ix_) des totaux vers les n colonnes de la fenetre, exprimé en lignes de X^T X
+#(mesuré sur un coeur ; avec plusieurs threads BLAS une ligne coute moins cher et ce nombre augmente)
+GATHER_ROWS = 256
+
+
+def _rows_outside(rows: slice, other: slice) -> list:
+    #lignes de rows absentes de other, en au plus deux tranches
+    parts = [
+        slice(rows.start, min(rows.stop, other.start)),
+        slice(max(rows.start, other.stop), rows.stop),
+    ]
+    return [part for part in parts if part.stop > part.start]
+
+
+def _row_count(parts: list) -> int:
+    return sum(part.stop - part.start for part in parts)
+
+
+class RollingCovariance:
+    def __init__(self, returns: ReturnsMatrix, permnos):
+        self.returns = returns
+        positions = returns.column_positions(permnos)
+        #colonnes fixes des totaux, triées comme la matrice de rendements (et donc comme les fenetres)
+        self.columns = np.unique(positions[positions >= 0])
+        self.position_of = {int(column): k for k, column in enumerate(self.columns)}
+
+        self.rows = None  #dernière fenetre vue, assemblée ou non
+        self.total_rows = None  #fenetre couverte par les totaux
+        self.cross = None
+        self.sums = None
+        self.count = 0
+        self._lock = threading.Lock()  #fenetres résolues dans des threads avec l'ordonnanceur ReplicaTOR
+
+    def __getstate__(self):
+        #un processus de travail ne voit qu'une fenetre : ni rendements ni totaux à copier
+        state = self.__dict__.copy()
+        state.update(returns=None, rows=None, total_rows=None, cross=None, sums=None, count=0, _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _move(self, leaving: list, entering: list) -> None:
+        #cross += E^T E - L^T L en un seul dgemm accumulé sur place (la mise à jour est symétrique,
+        #la vue transposée Fortran de cross peut donc la recevoir)
+        X = np.vstack([self.returns.window(part, self.columns) for part in entering + leaving])
+        signed = X.copy()
+        signed[_row_count(entering):] *= -1.0
+        self.cross = dgemm(1.0, X, signed, beta=1.0, c=self.cross.T, trans_a=True, overwrite_c=True).T
+        self.sums += signed.sum(axis=0)
+        self.count += _row_count(entering) - _row_count(leaving)
+
+    def _update(self, rows: slice, n: int) -> bool:
+        """Move the totals to ``rows`` when it is cheaper than ``np.corrcoef`` on n columns."""
+
+        m = self.columns.size
+        direct = (rows.stop - rows.start) * n * n
+        previous, self.rows = self.rows, rows
+
+        if self.total_rows is not None:
+            leaving = _rows_outside(self.total_rows, rows)
+            entering = _rows_outside(rows, self.total_rows)
+            if (_row_count(leaving) + _row_count(entering)) * m * m + GATHER_ROWS * n * n < direct:
+                self._move(leaving, entering)
+                self.total_rows = rows
+                return True
+            self.total_rows = self.cross = self.sums = None
+
+        #premiers totaux seulement si le pas depuis la fenetre précédente laisse prévoir des mises à jour rentables
+        if previous is None:
+            return False
+        step = _row_count(_rows_outside(previous, rows)) + _row_count(_rows_outside(rows, previous))
+        if step * m * m + GATHER_ROWS * n * n >= direct:
+            return False
+        X = self.returns.window(rows, self.columns)
+        self.cross = X.T @ X
+        self.sums = X.sum(axis=0)
+        self.count = rows.stop - rows.start
+        self.total_rows = rows
+        return True
+
+    def correlation(self, window):
+        """Pearson correlation matrix of ``window.returns``, or None when ``np.corrcoef`` is cheaper."""
+
+        if self.returns is None:
+            return None
+        positions = [self.position_of.get(int(column), -1) for column in self.returns.column_positions(window.permnos)]
+        if -1 in positions:
+            #titre hors des colonnes des totaux
+            return None
+        positions = np.asarray(positions, dtype=np.intp)
+        rows = self.returns.row_slice(window.start, window.end)
+
+        with self._lock:
+            if not self._update(rows, positions.size):
+                return None
+            cross = self.cross[np.ix_(positions, positions)]
+            sums = self.sums[positions]
+            count = self.count
+
+        #corrélation = covariance normalisée : le facteur 1 / (count - 1) se simplifie
+        cross -= np.multiply.outer(sums, sums / count)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            inv_std = 1.0 / np.sqrt(np.diag(cross))
+        cross *= inv_std
+        cross *= inv_std[:, None]
+        return np.clip(cross, -1, 1, out=cross)
@@ -0,0 +1,292 @@
+"""NumPy parallel tempering for the k-medoids QUBO, a local stand-in for ReplicaTOR.
+
+The solver reads the params file QUOB writes for ReplicaTOR (``num_vars``,
+``num_k``, ``B_scale_factor``, ``D_scale_factor``, ``T_min``, ``T_max``,
+``time_limit``, ``round_limit``, ``num_replicas_per_controller``,
+``num_controllers``, ``num_cores_per_controller``, ``ladder_init_mode``,
+``problem_path``/``problem_name``) and the distance matrix next to it, text or
+binary (``prafa.replicator_io``).  It minimises over selections S with
+|S| = num_k::
+
+    E(S) = B * sum_{i in S} sum_j D_ij  -  D * sum_{i < j in S} D_ij
+
+with B and D the two scale factors.  Moves swap one selected node u for an
+unselected node v, so the cardinality never changes, and with
+r_i = sum_{j in S} D_ij the energy change is::
+
+    dE = B * (rowsum_v - rowsum_u) - D * (r_v - r_u - D_uv)
+
+All replicas of a controller advance together: one round draws one move per
+replica, accepts it with the Metropolis rule at the replica's temperature and
+updates the accepted rows of r; the replicas of neighbouring temperatures then
+try to exchange.  The temperature ladder follows ``ladder_init_mode`` (0:
+linear in T, 1: linear in 1/T, 2: geometric).  A controller stops at the time
+limit, the round limit, or after ``STALL_ROUNDS`` rounds without improvement
+(or the ``StallPolicy`` QUOB passes with ``--stall_rounds``/``--stall_seconds``).
+With n <= K there is nothing to choose and every node is returned (``QUOB``
+returns every stock itself in that case and never runs a backend).
+
+``num_controllers * num_cores_per_controller`` independent replica groups run
+in a process pool sharing the distance matrix through shared memory, and the
+best one wins.  ``run_params`` prints progress lines that ``CostMonitor``
+parses and the same ``K Medoid Indices:`` block as ReplicaTOR, and writes
+``<problem_name>.soln.txt``; ``python -m prafa.tempering PARAMS`` does the
+same from the command line.  Every controller records its improvements, and
+``run_params`` merges them into the same best-cost trace CSV as
+``stream_replicator`` writes (elapsed seconds, round, best cost), so the trace
+is complete even when the controllers run in other processes.
+"""
+from __future__ import annotations
+
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+
+from prafa.replicator_io import read_distance_matrix
+from prafa.replicator_runner import ReplicatorResult, StallPolicy
+
+STALL_ROUNDS = 10000  #fenetre sans amélioration, comme ReplicaTOR
+LOG_EVERY = 1000
+
+
+def read_params(path) -> dict:
+    """Parse a ReplicaTOR params file: first token is the key, second the value, the rest is ignored."""
+
+    params = {}
+    for line in Path(path).read_text().splitlines():
+        tokens = line.split()
+        if len(tokens) < 2 or tokens[0].startswith("#"):
+            continue
+        key, value = tokens[0], tokens[1].split("#")[0]
+        for cast in (int, float):
+            try:
+                params[key] = cast(value)
+                break
+            except ValueError:
+                continue
+        else:
+            params[key] = value
+    return params
+
+
+def temperature_ladder(t_min: float, t_max: float, replicas: int, mode: int = 2) -> np.ndarray:
+    """Ascending temperatures of the replicas."""
+
+    if replicas == 1:
+        return np.array([t_min])
+    if mode == 0:
+        return np.linspace(t_min, t_max, replicas)
+    if mode == 1:
+        return 1 / np.linspace(1 / t_min, 1 / t_max, replicas)
+    return np.geomspace(t_min, t_max, replicas)
+
+
+def energy(D: np.ndarray, row_sums: np.ndarray, idx, b_scale: float, d_scale: float) -> float:
+    idx = np.asarray(idx, dtype=np.intp)
+    return float(b_scale * row_sums[idx].sum() - d_scale * 0.5 * D[np.ix_(idx, idx)].sum())
+
+
+def temper(D: np.ndarray, K: int, temperatures: np.ndarray, b_scale: float, d_scale: float,
+           time_limit: float, round_limit: int, seed: int = 0, log=None, stall: StallPolicy = None):
+    """One controller: returns (best selection, best energy, rounds, stalled, history).
+
+    ``history`` lists (elapsed seconds, round, best energy) at each improvement; ``stalled``
+    tells whether ``stall`` (rather than the time or round limit) ended the search.
+    """
+
+    start = time.monotonic()
+    n = D.shape[0]
+    row_sums = D.sum(axis=1)
+    if n <= K:
+        #rien à choisir : tous les noeuds
+        selection = np.arange(n)
+        best_energy = energy(D, row_sums, selection, b_scale, d_scale)
+        return selection, best_energy, 0, False, [(0.0, 0, best_energy)]
+
+    rng = np.random.default_rng(seed)
+    R = temperatures.size
+    replicas = np.arange(R)
+    #la fenetre native de STALL_ROUNDS reste la borne, comme pour ReplicaTOR
+    stall_rounds = min(STALL_ROUNDS, stall.rounds) if stall is not None and stall.rounds else STALL_ROUNDS
+    stall_seconds = stall.seconds if stall is not None and stall.seconds else None
+
+    #sélection de chaque réplique : K indices dedans, n - K dehors
+    order = np.argsort(rng.random((R, n)), axis=1)
+    inside, outside = order[:, :K].copy(), order[:, K:].copy()
+    r = np.stack([D[:, inside[k]].sum(axis=1) for k in range(R)])
+    energies = np.array([energy(D, row_sums, inside[k], b_scale, d_scale) for k in range(R)])
+    #température de chaque réplique : les échanges permutent les températures, pas les états
+    temperature_of = np.arange(R)
+
+    best = int(np.argmin(energies))
+    best_energy, best_selection = float(energies[best]), inside[best].copy()
+    last_improvement, last_improvement_time = 0, start
+    history = [(0.0, 0, best_energy)]
+    stalled = False
+
+    rounds = 0
+    while rounds < round_limit:
+        if rounds - last_improvement >= stall_rounds:
+            stalled = stall_rounds < STALL_ROUNDS
+            break
+        if rounds % 64 == 0:
+            now = time.monotonic()
+            if now - start > time_limit:
+                break
+            if stall_seconds is not None and now - last_improvement_time >= stall_seconds:
+                stalled = True
+                break
+        rounds += 1
+
+        pu = rng.integers(0, K, R)
+        pv = rng.integers(0, n - K, R)
+        u, v = inside[replicas, pu], outside[replicas, pv]
+        delta = (
+            b_scale * (row_sums[v] - row_sums[u])
+            - d_scale * (r[replicas, v] - r[replicas, u] - D[u, v])
+        )
+        T = temperatures[temperature_of]
+        with np.errstate(over="ignore"):
+            accept = (delta <= 0) | (rng.random(R) < np.exp(-delta / T))
+        if accept.any():
+            a = np.flatnonzero(accept)
+            r[a] += D[v[a]] - D[u[a]]
+            inside[a, pu[a]], outside[a, pv[a]] = v[a], u[a]
+            energies[a] += delta[a]
+
+            k = a[np.argmin(energies[a])]
+            if energies[k] < best_energy - 1e-12:
+                best_energy, best_selection = float(energies[k]), inside[k].copy()
+                last_improvement, last_improvement_time = rounds, time.monotonic()
+                history.append((last_improvement_time - start, rounds, best_energy))
+
+        #échange entre températures voisines (paires paires puis impaires)
+        by_temperature = np.argsort(temperature_of)
+        offset = rounds % 2
+        lower, upper = by_temperature[offset:-1:2], by_temperature[offset + 1::2]
+        m = min(lower.size, upper.size)
+        lower, upper = lower[:m], upper[:m]
+        beta_gap = 1 / temperatures[temperature_of[lower]] - 1 / temperatures[temperature_of[upper]]
+        swap = rng.random(m) < np.exp(np.minimum(0.0, beta_gap * (energies[lower] - energies[upper])))
+        temperature_of[lower[swap]], temperature_of[upper[swap]] = (
+            temperature_of[upper[swap]], temperature_of[lower[swap]],
+        )
+
+        if log is not None and rounds % LOG_EVERY == 0:
+            log(f"round {rounds} best cost: {best_energy!r}")
+
+    return np.sort(best_selection), best_energy, rounds, stalled, history
+
+
+_worker_state = {}
+
+
+def _attach_shared(name, n):
+    shm = shared_memory.SharedMemory(name=name)
+    _worker_state["handle"] = shm
+    _worker_state["D"] = np.ndarray((n, n), dtype=np.float64, buffer=shm.buf)
+
+
+def _temper_group(K, temperatures, b_scale, d_scale, time_limit, round_limit, seed, stall):
+    return temper(_worker_state["D"], K, temperatures, b_scale, d_scale, time_limit, round_limit, seed, stall=stall)
+
+
+def merge_histories(histories) -> list:
+    """Best-so-far (elapsed seconds, round, energy) over all controllers, in time order."""
+
+    trace, best = [], None
+    for elapsed, round_, value in sorted(event for history in histories for event in history):
+        if best is None or value < best:
+            best = value
+            trace.append((elapsed, round_, value))
+    return trace
+
+
+def solve(D: np.ndarray, params: dict, groups: int = 1, workers: int = 1, seed: int = 0, log=None,
+          stall: StallPolicy = None):
+    """Best (selection, energy, stalled, trace) over ``groups`` independent controllers run on ``workers`` processes.
+
+    ``stalled`` is True when every controller was ended by ``stall``; ``trace`` is ``merge_histories``.
+    """
+
+    D = np.ascontiguousarray(D, dtype=np.float64)
+    n = D.shape[0]
+    K = int(params["num_k"])
+    temperatures = temperature_ladder(
+        float(params.get("T_min", 1e-5)), float(params.get("T_max", 1e-2)),
+        int(params.get("num_replicas_per_controller", 32)), int(params.get("ladder_init_mode", 2)),
+    )
+    options = (
+        K, temperatures,
+        float(params.get("B_scale_factor", 0.5 * (K + 1) / n)), float(params.get("D_scale_factor", 1.0)),
+        float(params.get("time_limit", 300.0)), int(params.get("round_limit", 100000000)),
+    )
+
+    if groups <= 1 or workers <= 1:
+        results = [temper(D, *options, seed=seed + g, log=log, stall=stall) for g in range(max(1, groups))]
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, D.nbytes))
+        try:
+            np.ndarray(D.shape, dtype=np.float64, buffer=shm.buf)[:] = D
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach_shared, initargs=(shm.name, n)) as pool:
+                futures = [pool.submit(_temper_group, *options, seed + g, stall) for g in range(groups)]
+                results = [future.result() for future in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+
+    selection, best_energy, rounds, _, _ = min(results, key=lambda result: result[1])
+    if log is not None:
+        log(f"round {rounds} best cost: {best_energy!r}")
+    stalled = all(result[3] for result in results)
+    return selection, best_energy, stalled, merge_histories(result[4] for result in results)
+
+
+def run_params(params_path, workers: int = None, stream=None, trace_path=None,
+               stall: StallPolicy = None) -> ReplicatorResult:
+    """Solve the problem described by a ReplicaTOR params file, like the binary would.
+
+    Progress lines are also written to ``stream`` as they come when it is given.  ``trace_path``
+    and ``stall`` mean the same as for ``stream_replicator``: the best-cost trace CSV, and the
+    search is ended once the cost has stalled (``grace`` does not apply, nothing is killed).
+    """
+
+    params = read_params(params_path)
+    problem = Path(str(params["problem_path"])) / str(params["problem_name"])
+    D = read_distance_matrix(f"{problem}.d")
+
+    groups = int(params.get("num_controllers", 1)) * int(params.get("num_cores_per_controller", 1))
+    workers = min(groups, workers or os.cpu_count() or 1)
+
+    stdout = io.StringIO()
+
+    def log(line):
+        print(line, file=stdout)
+        if stream is not None:
+            print(line, file=stream, flush=True)
+
+    selection, _, stalled, trace = solve(D, params, groups=groups, workers=workers, log=log, stall=stall)
+    log("K Medoid Indices: " + " ".join(map(str, selection)))
+    Path(f"{problem}.soln.txt").write_text(" ".join(map(str, selection)))
+    if trace_path:
+        with open(trace_path, "w") as f:
+            f.write("elapsed_seconds,round,best_cost\n")
+            for elapsed, round_, value in trace:
+                f.write(f"{elapsed:.3f},{round_},{value!r}\n")
+    return ReplicatorResult(0, stdout.getvalue(), "", stopped_early=stalled)
+
+
+def main() -> None:
+    if len(sys.argv) != 2:
+        raise SystemExit("usage: python -m prafa.tempering PARAMS_FILE")
+    run_params(sys.argv[1], stream=sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
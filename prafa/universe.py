@@ -1,11 +1,43 @@
 import pandas as pd
+from dataclasses import dataclass
 from datetime import datetime
 import numpy as np
+from dateutil.relativedelta import relativedelta
 
+from prafa.constituents import Membership
+from prafa.returns_store import ReturnsMatrix, load_returns
 
 
 
 
+
+@dataclass(frozen=True, eq=False)
+class UniverseWindow:
+    """
+        Instantané immuable (et picklable) d'un univers sur une fenetre de temps.
+        eq=False : les champs ndarray ne se comparent pas avec ==, deux fenetres sont égales si c'est le meme objet.
+
+        returns : matrice (dates x permnos) des rendements, NaN remplacés par 0
+        index_returns : vecteur des rendements de l'indice entre start et end (dates du fichier de l'indice)
+        permnos : ordre des colonnes de returns
+        dates : dates des lignes de returns
+    """
+    start : pd.Timestamp
+    end : pd.Timestamp
+    training : bool
+    returns : np.ndarray
+    index_returns : np.ndarray
+    permnos : tuple
+    dates : pd.DatetimeIndex
+
+    @property
+    def num_assets(self) -> int:
+        return len(self.permnos)
+
+    def returns_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.returns, index=self.dates, columns=list(self.permnos))
+
+
 class Universe():
     
     
@@ -26,81 +58,124 @@ class Universe():
     
 
     def initialisation_donnes(self):
+        #matrice d'appartenance (dates effectives x permnos) construite une seule fois
+        self.membership = Membership(f"financial_data/{self.args.index}/constituants")
+
         #données sur toutes l'historique
-        self.df_return_all = pd.read_csv(f"financial_data/{self.args.index}/returns_stocks.csv")  #return des stocks 
+        #le store binaire (scripts/convert_returns_store.py) est utilisé s'il existe, sinon on lit le csv
+        #la matrice est mappée en mémoire, les fenetres sont extraites par indices entiers
+        returns_path = f"financial_data/{self.args.index}/returns_stocks.csv"
+        if getattr(self.args, "prune_columns", False):
+            #seulement les permnos membres entre start_date et end_date,
+            #et les dates à partir de start_date moins la fenetre d'entrainement de T années
+            first_date = pd.Timestamp(self.args.start_date) - relativedelta(years=getattr(self.args, "T", 0))
+            self.returns_all = ReturnsMatrix.open(
+                returns_path, "date",
+                permnos=self.membership.members_between(self.args.start_date, self.args.end_date),
+                start=first_date,
+                end=pd.Timestamp(self.args.end_date),
+            )
+        else:
+            self.returns_all = ReturnsMatrix.open(returns_path, "date")  #return des stocks 
         #self.df_return_all.columns = [col.split()[0].replace('/', '.') for col in self.df_return_all.columns]
-        self.df_return_all['date'] = pd.to_datetime(self.df_return_all['date'])
-        self.df_return_all.set_index('date', inplace=True)
 
-        self.df_index_all = pd.read_csv(f"financial_data/{self.args.index}/returns_index.csv")   #return de l'indice
-        self.df_index_all['Date'] = pd.to_datetime(self.df_index_all['Date'])
-        self.df_index_all.set_index('Date', inplace=True)
+        self.df_index_all = load_returns(f"financial_data/{self.args.index}/returns_index.csv", "Date")   #return de l'indice
+
+        #position de chaque permno de la matrice d'appartenance dans les colonnes de rendements (-1 si absent)
+        self.membership_columns = self.returns_all.column_positions(self.membership.permnos)
 
     
     def update_stock_list(self, datetime : datetime = None):
-        #ce code va aller chercher la compositon
-        #df = lambda year : pd.read_csv(f"financial_data/{self.args.index}/constituants/{year}.csv",usecols=["Ticker"]).str.split().str[0].str.replace("/", ".")
-        df = lambda year: pd.read_csv(
-                f"financial_data/{self.args.index}/constituants/{year}.csv", dtype={'permno': str})["permno"]
-        
+        #ce code va aller chercher la compositon en vigueur à la date donnée
+        #(n'importe quelle date, pas seulement au changement d'année)
         if datetime is None:
             #appelle dans le constructeur premier universe
-            self.year = int(self.args.start_date[0:4])
-            self.stock_list = df(self.year).tolist()
+            datetime = pd.Timestamp(self.args.start_date)
 
-        elif datetime.year != self.year:
-            #puisque le rebalancement se fait par an,
-            #on va chercher la liste des stocks pour l'année en cours
-            #sinon on va chercher les stocks pour la nouvelle année
-            self.year = datetime.year
-            self.stock_list = df(self.year).tolist()
+        self.year = datetime.year
+        self.stock_list = self.membership.members_at(datetime).tolist()
 
         return self.stock_list
+
+    def universe_columns(self, datetime : datetime):
+        #colonnes (triées) de la matrice de rendements pour les membres de l'indice à la date donnée,
+        #et les membres absents des données de rendement
+        in_index = self.membership.mask_at(datetime)
+        positions = self.membership_columns[in_index]
+        missing_stocks = set(self.membership.permnos[in_index][positions < 0])
+        return np.sort(positions[positions >= 0]), missing_stocks
+
+    @property
+    def df_return_all(self) -> pd.DataFrame:
+        #vue pandas (sans copie) de toute la matrice de rendements
+        return self.returns_all.to_frame()
     
 
-    def new_universe(
+    def window(
         self,
         start_datetime : datetime,
         end_datetime : datetime,
         training : bool = True
-    )   :
+    ) -> UniverseWindow :
         """
-            Create a new universe with the specified time range.
+            Fonction pure de (start, end, training) : ne modifie pas l'état de l'univers.
 
-            par contre, dependamment si l'univers est pour entrainement ou pour le backtesting, on va devoir changer 
-            ou on appelle la fonction get_stock_list
             si c'est pour l'entrainement, on va chercher la liste des stocks au moment end_datetime
             si c'est pour le backtesting, on va chercher la liste des stocks au moment start
         """
-      
-        
-        if type(start_datetime) != type(pd.Timestamp('now')):
-            start_datetime = pd.Timestamp(start_datetime)
-        if type(end_datetime) != type(pd.Timestamp('now')):
-            end_datetime = pd.Timestamp(end_datetime)
-        
+        start_datetime = pd.Timestamp(start_datetime)
+        end_datetime = pd.Timestamp(end_datetime)
+
         #ajustement des stocks dans l'univers
-        if training:
-            self.update_stock_list(end_datetime)
-        else:
-            self.update_stock_list(start_datetime)
+        composition_date = end_datetime if training else start_datetime
+        columns, missing_stocks = self.universe_columns(composition_date)
         
-        # ⚠️ À mettre dans la méthode new_universe juste avant d'extraire les rendements :
-        valid_stocks = [stock for stock in self.stock_list if stock in self.df_return_all.columns]
-        missing_stocks = set(self.stock_list) - set(valid_stocks)
-     
         if missing_stocks:
             print(f"⚠️ Les actions suivantes ne sont pas dans les données de rendement : {missing_stocks}")
-        self.stock_list = valid_stocks
-        
         
-        # On trie self.stock_list selon l'ordre des colonnes de df_return_all
-        ordered_stocks = [stock for stock in self.df_return_all.columns if stock in self.stock_list]
+        # Les colonnes sont triées selon l'ordre de la matrice de rendements
+        rows = self.returns_all.row_slice(start_datetime, end_datetime)
+        returns = self.returns_all.window(rows, columns)
+        index_returns = self.df_index_all.loc[start_datetime:end_datetime].iloc[:, 0].fillna(0).to_numpy(dtype=np.float64)
+        returns.flags.writeable = False
+        index_returns.flags.writeable = False
+
+        return UniverseWindow(
+            start=start_datetime,
+            end=end_datetime,
+            training=training,
+            returns=returns,
+            index_returns=index_returns,
+            permnos=tuple(self.returns_all.columns[columns]),
+            dates=self.returns_all.dates[rows],
+        )
+
+
+    def new_universe(
+        self,
+        start_datetime : datetime,
+        end_datetime : datetime,
+        training : bool = True
+    )   :
+        """
+            Create a new universe with the specified time range.
+
+            par contre, dependamment si l'univers est pour entrainement ou pour le backtesting, on va devoir changer 
+            ou on appelle la fonction get_stock_list
+            si c'est pour l'entrainement, on va chercher la liste des stocks au moment end_datetime
+            si c'est pour le backtesting, on va chercher la liste des stocks au moment start
+
+            Met à jour l'état partagé (df_return, df_index, stock_list, year) à partir de window().
+        """
+        window = self.window(start_datetime, end_datetime, training)
+
+        self.year = (window.end if training else window.start).year
         #retourne les stocks de l'univers au bonne periode de temps
-        self.df_return = self.df_return_all.loc[start_datetime:end_datetime, ordered_stocks].copy().fillna(0)
-        self.df_index = self.df_index_all.loc[start_datetime:end_datetime].copy().fillna(0)
+        self.df_return = window.returns_frame()
+        self.df_index = self.df_index_all.loc[window.start:window.end].copy().fillna(0)
         #self.data_cleaning()
-        self.stock_list = list(self.df_return.columns)
+        self.stock_list = list(window.permnos)
+        return window
 
     
 
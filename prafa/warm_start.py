@@ -0,0 +1,203 @@
+"""Warm starts for the medoid selection of consecutive rebalancing windows.
+
+QUOB and Gurobi both minimise a binary quadratic k-medoids objective over the
+selection S (|S| = K) of an n x n distance matrix D::
+
+    f(S) = beta * sum_{i in S} sum_j D_ij  -  alpha/2 * sum_{i, j in S} D_ij
+
+but not with the same weights.  Gurobi's BQO uses alpha = 1/K and
+beta = 1/n (``Objective.gurobi``); ReplicaTOR (and ``prafa.tempering``)
+minimise the energy of its params file, alpha = D_scale_factor and
+beta = B_scale_factor (``Objective.quob``).  Every function below takes the
+``Objective`` of the backend whose selection it compares or refines, so a
+warm start or a polish never ranks selections by a function the backend was
+not solving.  Without one, the Gurobi weights are used.
+
+Consecutive yearly windows overlap by two thirds, so the selection of the
+previous rebalance is a good start for the next one.  ``Selection`` keeps the
+previous medoids together with their rows of the previous D.  ``map_to`` carries
+them onto a new permno universe: surviving names keep their place, and a
+dropped name is replaced by its nearest surviving neighbour in the previous D.
+
+With c = beta * D 1 and r_i = sum_{j in S} D_ij, swapping u in S for v outside
+changes the objective by::
+
+    delta(u, v) = c_v - c_u + alpha * (r_u - r_v + D_uv)
+
+``swap_refine`` keeps c and r as per-node arrays and scans the K x (n - K)
+table of swaps in blocks of candidate columns: the best swap of a block is
+applied as soon as it improves, r is updated in O(n), and the search stops
+after a full pass without improvement, after ``max_swaps`` swaps or when the
+time budget runs out.  It warm-starts a rebalance from the previous medoids
+and also polishes the selection returned by ReplicaTOR or Gurobi
+(``polish``).  The formula assumes D_ii = 0, which the distance functions of
+``prafa.distance`` guarantee; the functions below raise ``ValueError`` on any
+other diagonal instead of silently optimising a different objective.
+"""
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+
+def check_diagonal(D: np.ndarray) -> None:
+    #delta(u, v) et les gains d'ajout/retrait supposent D_ii = 0
+    if np.any(np.diagonal(D) != 0):
+        raise ValueError("the distance matrix must have a zero diagonal")
+
+
+@dataclass(frozen=True)
+class Objective:
+    #poids de f(S) : alpha sur les distances entre médoïdes, beta sur les sommes de lignes
+    alpha: float
+    beta: float
+
+    @classmethod
+    def gurobi(cls, K: int, n: int) -> "Objective":
+        return cls(1 / K, 1 / n)
+
+    @classmethod
+    def quob(cls, b_scale: float, d_scale: float) -> "Objective":
+        #énergie B * sum_{i in S} rowsum_i - D * sum_{i < j in S} D_ij du fichier params
+        return cls(d_scale, b_scale)
+
+    def weights(self, D: np.ndarray):
+        """(alpha, c) with c = beta * D 1."""
+
+        return self.alpha, self.beta * D.sum(axis=1)
+
+
+def _objective(objective: Objective, K: int, n: int) -> Objective:
+    return Objective.gurobi(K, n) if objective is None else objective
+
+
+def selection_cost(D: np.ndarray, idx, K: int, objective: Objective = None) -> float:
+    """Objective f(S) of the selection ``idx``."""
+
+    check_diagonal(D)
+    idx = np.asarray(idx, dtype=np.intp)
+    objective = _objective(objective, K, D.shape[0])
+    return float(objective.beta * D[idx].sum() - 0.5 * objective.alpha * D[np.ix_(idx, idx)].sum())
+
+
+def complete_selection(D: np.ndarray, idx, K: int, objective: Objective = None) -> np.ndarray:
+    """Greedily add (or remove) medoids until ``idx`` holds exactly ``K`` distinct indices."""
+
+    check_diagonal(D)
+    n = D.shape[0]
+    alpha, c = _objective(objective, K, n).weights(D)
+    selected = np.zeros(n, dtype=bool)
+    selected[np.asarray(idx, dtype=np.intp)] = True
+    r = D[:, selected].sum(axis=1)
+
+    while selected.sum() < K:
+        #ajouter v change l'objectif de c_v - alpha * r_v
+        gain = np.where(selected, np.inf, c - alpha * r)
+        v = int(np.argmin(gain))
+        selected[v] = True
+        r += D[:, v]
+    while selected.sum() > K:
+        #retirer u change l'objectif de -c_u + alpha * r_u
+        gain = np.where(selected, alpha * r - c, np.inf)
+        u = int(np.argmin(gain))
+        selected[u] = False
+        r -= D[:, u]
+    return np.flatnonzero(selected)
+
+
+def swap_refine(D: np.ndarray, idx, K: int, max_swaps: int = None, time_limit: float = None,
+                block: int = 256, tol: float = 1e-12, objective: Objective = None) -> np.ndarray:
+    """Swap local search from ``idx``; returns the refined selection (sorted)."""
+
+    check_diagonal(D)
+    start = time.monotonic()
+    n = D.shape[0]
+    objective = _objective(objective, K, n)
+    alpha, c = objective.weights(D)
+    selected = np.zeros(n, dtype=bool)
+    selected[complete_selection(D, idx, K, objective)] = True
+    r = D[:, selected].sum(axis=1)
+
+    swaps = 0
+    improved = True
+    while improved:
+        improved = False
+        inside, outside = np.flatnonzero(selected), np.flatnonzero(~selected)
+        for first in range(0, outside.size, block):
+            if (max_swaps is not None and swaps >= max_swaps) or (
+                time_limit is not None and time.monotonic() - start > time_limit
+            ):
+                return np.flatnonzero(selected)
+            candidates = outside[first : first + block]
+            candidates = candidates[~selected[candidates]]
+            if candidates.size == 0:
+                continue
+            #delta(u, v) = c_v - c_u + alpha * (r_u - r_v + D_uv) pour un bloc de candidats v
+            delta = (
+                (c[candidates] - alpha * r[candidates])[None, :]
+                - (c[inside] - alpha * r[inside])[:, None]
+                + alpha * D[np.ix_(inside, candidates)]
+            )
+            best = int(np.argmin(delta))
+            if delta.flat[best] >= -tol:
+                continue
+            row, col = divmod(best, candidates.size)
+            u, v = inside[row], candidates[col]
+            selected[u], selected[v] = False, True
+            r += D[:, v] - D[:, u]
+            inside[row] = v
+            swaps += 1
+            improved = True
+    return np.flatnonzero(selected)
+
+
+def polish(D: np.ndarray, idx, K: int, time_limit: float, objective: Objective = None) -> list:
+    """Swap local search on a solver's selection, within ``time_limit`` seconds.
+
+    ``objective`` must be the one the solver minimised; the input is returned
+    unchanged unless the swaps lower it.
+    """
+
+    before = selection_cost(D, idx, K, objective)
+    polished = swap_refine(D, idx, K, time_limit=time_limit, objective=objective)
+    after = selection_cost(D, polished, K, objective)
+    if after < before:
+        print(f"Swap polishing lowered the objective from {before:.6g} to {after:.6g}")
+        return polished.tolist()
+    return list(idx)
+
+
+@dataclass(frozen=True, eq=False)
+class Selection:
+    #médoïdes d'un rebalancement et leurs lignes de D, pour démarrer le suivant
+    permnos: tuple
+    medoids: np.ndarray
+    distances: np.ndarray  #D[medoids], K x len(permnos)
+
+    @classmethod
+    def from_solve(cls, permnos, idx, D: np.ndarray) -> "Selection":
+        idx = np.asarray(idx, dtype=np.intp)
+        return cls(tuple(permnos), idx, np.array(D[idx], dtype=np.float32))
+
+    def map_to(self, permnos) -> np.ndarray:
+        """Medoid indices in the universe ``permnos``; dropped names become their nearest surviving neighbour."""
+
+        position = {permno: j for j, permno in enumerate(permnos)}
+        new_of_old = np.fromiter((position.get(p, -1) for p in self.permnos), dtype=np.intp, count=len(self.permnos))
+        available = new_of_old >= 0
+        available[self.medoids[new_of_old[self.medoids] >= 0]] = False
+
+        mapped = []
+        for row, medoid in enumerate(self.medoids):
+            if new_of_old[medoid] >= 0:
+                mapped.append(new_of_old[medoid])
+                continue
+            #plus proche voisin encore présent dans le nouvel univers et pas déjà choisi
+            candidates = np.where(available, self.distances[row], np.inf)
+            neighbour = int(np.argmin(candidates))
+            if np.isfinite(candidates[neighbour]):
+                mapped.append(new_of_old[neighbour])
+                available[neighbour] = False
+        return np.asarray(mapped, dtype=np.intp)
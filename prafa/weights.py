@@ -0,0 +1,166 @@
+"""Tracking weights of the selected stocks: least squares on the probability simplex.
+
+Once the medoids are chosen, QUOB, Gurobi and KMedoids fit weights w::
+
+    minimise ||X w - y||^2   subject to   w >= 0,  sum(w) = 1
+
+with X the T x K returns of the selection and y the index returns.  SLSQP
+solved it with finite-difference gradients over the full T x K matrix.  The
+problem only depends on the Gram matrix G = X^T X and b = X^T y::
+
+    minimise 1/2 w^T G w - b^T w
+
+``simplex_least_squares`` solves it with a primal active-set method.  On the
+free set P it solves the equality-constrained KKT system::
+
+    [G_PP  1] [w_P]   [b_P]
+    [1^T   0] [-nu] = [ 1 ]
+
+and steps towards w_P, dropping the weights that reach zero on the way.  When
+w_P is strictly positive, the multipliers of the stocks at zero are
+mu = G w - b - nu; the most negative one enters P, and the weights are
+KKT-optimal once every mu >= -tol.  With K > T the Gram matrix is singular, so
+a tiny ridge (``ridge`` times the mean of its diagonal) keeps the KKT systems
+solvable.  If ``max_iter`` active-set changes are not enough, the current
+weights are returned with a warning, since they are then not KKT-optimal.
+
+Full replication (``Solution.lagrange_full_replication``) fits the same
+problem over the whole universe, n = 3000.  ``simplex_fista`` runs FISTA on it:
+a gradient step G w - b with step 1/L (L the largest eigenvalue of G, from
+Lanczos), a Euclidean projection onto the simplex (``project_simplex``, sort
+based, O(n log n)), Nesterov momentum restarted whenever it points uphill, and
+a stop once the gradient mapping L * ||y - P(y - (G y - b) / L)|| falls under
+``tol`` times the scale of b.  One product by G per iteration; with fewer days
+than stocks ``full_replication_weights`` applies G as X^T (X v).
+"""
+from __future__ import annotations
+
+import numpy as np
+from scipy.sparse.linalg import LinearOperator, eigsh
+
+
+def simplex_least_squares(G: np.ndarray, b: np.ndarray, tol: float = 1e-10, ridge: float = 1e-12,
+                          max_iter: int = None) -> np.ndarray:
+    """Minimiser of 1/2 w^T G w - b^T w over the probability simplex."""
+
+    G = np.asarray(G, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    K = b.size
+    if K == 1:
+        return np.ones(1)
+    G = G + ridge * max(np.trace(G) / K, 1e-300) * np.eye(K)
+    max_iter = 10 * K if max_iter is None else max_iter
+    scale = max(1.0, np.abs(b).max(), np.abs(np.diag(G)).max())
+
+    #départ sur le meilleur sommet du simplexe : w = e_i, objectif G_ii / 2 - b_i
+    first = int(np.argmin(0.5 * np.diag(G) - b))
+    w = np.zeros(K)
+    w[first] = 1.0
+    free = np.zeros(K, dtype=bool)
+    free[first] = True
+
+    for _ in range(max_iter):
+        P = np.flatnonzero(free)
+        kkt = np.zeros((P.size + 1, P.size + 1))
+        kkt[:-1, :-1] = G[np.ix_(P, P)]
+        kkt[:-1, -1] = kkt[-1, :-1] = 1.0
+        solution = np.linalg.solve(kkt, np.append(b[P], 1.0))
+        target = solution[:-1]
+
+        if target.min() <= 0:
+            #pas vers target jusqu'au premier poids qui s'annule, qui sort de P
+            shrinking = target <= 0
+            steps = w[P][shrinking] / (w[P][shrinking] - target[shrinking])
+            step = steps.min()
+            w[P] += step * (target - w[P])
+            leaving = P[shrinking][steps <= step + 1e-15]
+            w[leaving] = 0.0
+            free[leaving] = False
+            w[w < 0] = 0.0
+            continue
+
+        w[:] = 0.0
+        w[P] = target
+        #multiplicateurs des poids à zéro : mu = G w - b - nu
+        nu = -solution[-1]
+        mu = G @ w - b - nu
+        mu[free] = np.inf
+        entering = int(np.argmin(mu))
+        if mu[entering] >= -tol * scale:
+            break
+        free[entering] = True
+    else:
+        #itérations épuisées : les poids ne vérifient pas les conditions KKT
+        print(f"⚠️ simplex_least_squares stopped after {max_iter} iterations without reaching KKT optimality "
+              f"({int(free.sum())} of {K} weights free); the weights are feasible but not optimal")
+
+    return w / w.sum()
+
+
+def tracking_weights(returns: np.ndarray, index_returns: np.ndarray, **options) -> np.ndarray:
+    """Simplex-constrained least-squares weights of ``returns`` (T x K) tracking ``index_returns``."""
+
+    #moindres carrés sur le simplexe à partir de G = X^T X et b = X^T y (ensemble actif, KKT exact)
+    returns = np.asarray(returns, dtype=np.float64)
+    index_returns = np.asarray(index_returns, dtype=np.float64)
+    return simplex_least_squares(returns.T @ returns, returns.T @ index_returns, **options)
+
+
+def project_simplex(v: np.ndarray) -> np.ndarray:
+    """Euclidean projection of ``v`` onto {w >= 0, sum(w) = 1}."""
+
+    u = np.sort(v)[::-1]
+    cumulative = np.cumsum(u) - 1.0
+    ranks = np.arange(1, v.size + 1)
+    #dernier indice où u_k reste positif après décalage : il fixe le seuil theta
+    rho = np.flatnonzero(u - cumulative / ranks > 0)[-1]
+    theta = cumulative[rho] / (rho + 1)
+    return np.maximum(v - theta, 0.0)
+
+
+def simplex_fista(G, b: np.ndarray, tol: float = 1e-9, max_iter: int = 20000,
+                  w0: np.ndarray = None) -> np.ndarray:
+    """Minimiser of 1/2 w^T G w - b^T w over the probability simplex, by FISTA with adaptive restart.
+
+    ``G`` is the Gram matrix or a ``LinearOperator`` applying it.
+    """
+
+    b = np.asarray(b, dtype=np.float64)
+    n = b.size
+    if n == 1:
+        return np.ones(1)
+    #pas 1/L, L = plus grande valeur propre de G (Lanczos) avec une petite marge
+    L = eigsh(G, k=1, which='LA', return_eigenvectors=False)[0] * 1.01 + 1e-300
+    #tolérance relative à l'échelle des rendements (G et b ~ T * variance)
+    scale = max(np.abs(b).max(), 1e-300)
+
+    w = project_simplex(np.full(n, 1.0 / n) if w0 is None else np.asarray(w0, dtype=np.float64))
+    y, t = w.copy(), 1.0
+    for _ in range(max_iter):
+        w_next = project_simplex(y - (G @ y - b) / L)
+        #application du gradient en y : L * ||y - w_next|| mesure l'écart aux conditions KKT, sans produit de plus
+        if L * np.linalg.norm(y - w_next) <= tol * scale:
+            return w_next
+        #redémarrage adaptatif : l'élan va contre la descente
+        if np.dot(y - w_next, w_next - w) > 0:
+            t = 1.0
+            y = w
+            continue
+        t_next = 0.5 * (1 + np.sqrt(1 + 4 * t * t))
+        y = w_next + (t - 1) / t_next * (w_next - w)
+        w, t = w_next, t_next
+    return w
+
+
+def full_replication_weights(returns: np.ndarray, index_returns: np.ndarray, **options) -> np.ndarray:
+    """Simplex-constrained least-squares weights over a whole universe (T x n returns), by ``simplex_fista``."""
+
+    returns = np.asarray(returns, dtype=np.float64)
+    index_returns = np.asarray(index_returns, dtype=np.float64)
+    T, n = returns.shape
+    if T >= n:
+        G = returns.T @ returns
+    else:
+        #X^T (X v) coute 2 T n au lieu des n^2 de G v quand il y a moins de jours que d'actions
+        G = LinearOperator((n, n), matvec=lambda v: returns.T @ (returns @ v), dtype=np.float64)
+    return simplex_fista(G, returns.T @ index_returns, **options)
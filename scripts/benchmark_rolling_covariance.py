@@ -0,0 +1,92 @@
+"""Compare ``--rolling_covariance`` with ``np.corrcoef`` on synthetic returns.
+
+Builds a random (days x n_all) return matrix, a run universe of ``n_run``
+permnos and one training window of ``n`` of them per rebalancing date, then
+times the correlation of every window both ways and checks that they agree::
+
+    python scripts/benchmark_rolling_covariance.py --n_all 5000 --n_run 3300 --n 3000 --rebalancing 1
+
+The totals only live for one run and only move between consecutive windows:
+with ``--rebalancing 12`` every window falls back to ``np.corrcoef`` and the
+two timings match, while monthly steps are faster once the totals are built
+(about 1.4x per window at n = 3000 on one core).
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from prafa.rolling_covariance import RollingCovariance
+from prafa.returns_store import ReturnsMatrix
+from prafa.universe import UniverseWindow
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the rolling X^T X totals against np.corrcoef")
+    parser.add_argument("--n_all", type=int, default=2000, help="Colonnes de la matrice de rendements")
+    parser.add_argument("--n_run", type=int, default=1300, help="Permnos membres pendant le backtest")
+    parser.add_argument("--n", type=int, default=1200, help="Permnos de chaque fenetre")
+    parser.add_argument("--T", type=int, default=3, help="Années d'entrainement")
+    parser.add_argument("--rebalancing", type=int, default=1, help="Pas de rebalancement en mois")
+    parser.add_argument("--windows", type=int, default=12, help="Nombre de fenetres")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    first_end = pd.Timestamp("2014-01-02")
+    start = first_end - relativedelta(years=args.T)
+    last_end = first_end + relativedelta(months=args.rebalancing * (args.windows - 1))
+    dates = pd.bdate_range(start, last_end)
+    values = rng.normal(0.0005, 0.02, size=(len(dates), args.n_all))
+    values[rng.random(values.shape) < 0.01] = np.nan
+    returns = ReturnsMatrix(values, dates, [str(p) for p in range(args.n_all)])
+
+    run_permnos = np.sort(rng.choice(args.n_all, size=args.n_run, replace=False))
+    rolling = RollingCovariance(returns, [str(p) for p in run_permnos])
+
+    direct_seconds = rolling_seconds = 0.0
+    assembled_seconds = []
+    worst = 0.0
+    for w in range(args.windows):
+        end = first_end + relativedelta(months=args.rebalancing * w)
+        window_start = end - relativedelta(years=args.T)
+        columns = np.sort(rng.choice(run_permnos, size=args.n, replace=False))
+        rows = returns.row_slice(window_start, end)
+        window = UniverseWindow(
+            start=window_start, end=end, training=True,
+            returns=returns.window(rows, columns), index_returns=np.zeros(rows.stop - rows.start),
+            permnos=tuple(returns.columns[columns]), dates=returns.dates[rows],
+        )
+
+        tick = time.perf_counter()
+        expected = np.corrcoef(window.returns, rowvar=False)
+        direct_seconds += time.perf_counter() - tick
+
+        tick = time.perf_counter()
+        corr = rolling.correlation(window)
+        if corr is None:
+            corr = np.corrcoef(window.returns, rowvar=False)
+        elif rolling.total_rows is not None:
+            assembled_seconds.append(time.perf_counter() - tick)
+        rolling_seconds += time.perf_counter() - tick
+        worst = max(worst, float(np.nanmax(np.abs(corr - expected))))
+
+    print(f"{args.windows} windows, n={args.n}, n_run={args.n_run}, rebalancing={args.rebalancing} months")
+    print(f"np.corrcoef       : {direct_seconds:.2f}s ({direct_seconds / args.windows:.3f}s per window)")
+    print(f"rolling totals    : {rolling_seconds:.2f}s ({len(assembled_seconds)} windows assembled)")
+    if len(assembled_seconds) > 1:
+        #la première fenetre assemblée construit les totaux
+        print(f"  once built      : {np.mean(assembled_seconds[1:]):.3f}s per window")
+    print(f"max |difference|  : {worst:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Convert the wide return CSVs of an index into the binary store.
+
+``Universe`` loads ``financial_data/<index>/returns_stocks.npy`` (plus its
+``.dates.npy`` and ``.columns.npy`` sidecars) instead of parsing the CSV when
+the binary files are present and up to date.  Run this script once after
+downloading or refreshing the CSVs::
+
+    python scripts/convert_returns_store.py --index russell3000
+
+The CSVs are left untouched and remain the fallback source.
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+from prafa.returns_store import convert_csv
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert return CSVs into the binary store")
+    parser.add_argument("--data_path", type=Path, default=Path("financial_data"), help="Chemin des données")
+    parser.add_argument("--index", type=str, default="russell3000", help="Indice à convertir")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    index_dir = args.data_path / args.index
+
+    for file_name, date_column in (("returns_stocks.csv", "date"), ("returns_index.csv", "Date")):
+        csv_path = index_dir / file_name
+        if not csv_path.exists():
+            raise FileNotFoundError(f"Return file not found: {csv_path}")
+
+        start = time.perf_counter()
+        paths = convert_csv(csv_path, date_column)
+        print(f"Converted {csv_path} -> {paths['values']} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
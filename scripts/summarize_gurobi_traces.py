@@ -0,0 +1,102 @@
+"""Summarise the Gurobi traces written with ``--gurobi_trace_interval``.
+
+Each solve leaves ``<result_path>/gurobi_traces/<solver>_<index>_<K>_<date>.csv``
+with one row per sample (elapsed seconds, incumbent, bound, gap, nodes).  The
+solver, index, cardinality and window end are read from the CSV's own columns,
+not from the file name, since index names may contain underscores.  For
+every window this script reports when the incumbent last improved, the final
+gap and how much of the solve came after the last improvement::
+
+    python scripts/summarize_gurobi_traces.py --result_path results
+
+The last-improvement quantiles printed at the end are a starting point for
+``--time_limit`` at that universe size.
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+METADATA = ("solver", "index", "cardinality", "window_end")
+
+
+def summarize_trace(path: Path, tol: float) -> dict:
+    trace = pd.read_csv(path, dtype={"solver": str, "index": str, "window_end": str})
+    missing = [name for name in METADATA if name not in trace.columns]
+    if missing:
+        raise ValueError(f"{path} has no {', '.join(missing)} column(s); it predates the trace metadata columns")
+    solver, index, cardinality, date = (trace[name].iloc[0] for name in METADATA)
+    final = trace.iloc[-1]
+    incumbents = trace.dropna(subset=["incumbent"])
+
+    last_improvement = np.nan
+    if not incumbents.empty:
+        best = incumbents["incumbent"].min()
+        #premier instant où l'incumbent atteint (à tol près) sa valeur finale
+        reached = incumbents[incumbents["incumbent"] <= best + tol * max(abs(best), 1e-10)]
+        last_improvement = float(reached["elapsed_seconds"].iloc[0])
+
+    return {
+        "solver": solver,
+        "index": index,
+        "cardinality": int(cardinality),
+        "window_end": date,
+        "runtime": float(final["elapsed_seconds"]),
+        "last_improvement": last_improvement,
+        "idle_share": 1 - last_improvement / final["elapsed_seconds"] if final["elapsed_seconds"] > 0 else np.nan,
+        "incumbent": final["incumbent"],
+        "bound": final["bound"],
+        "gap": final["gap"],
+        "nodes": final["nodes"],
+    }
+
+
+def summarize(trace_dir: Path, tol: float) -> pd.DataFrame:
+    paths = sorted(trace_dir.glob("*.csv"))
+    if not paths:
+        raise FileNotFoundError(f"No Gurobi trace found in {trace_dir}")
+    rows = []
+    for path in paths:
+        try:
+            rows.append(summarize_trace(path, tol))
+        except ValueError as error:
+            print(f"⚠️ skipped: {error}", file=sys.stderr)
+    if not rows:
+        raise FileNotFoundError(f"No Gurobi trace with metadata columns found in {trace_dir}")
+    return pd.DataFrame(rows)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Résumé des traces Gurobi (incumbent, borne, gap) par fenetre")
+    parser.add_argument("--result_path", type=Path, default=Path("results"), help="Chemin des résultats")
+    parser.add_argument("--trace_dir", type=Path, default=None, help="Dossier des traces (défaut : <result_path>/gurobi_traces)")
+    parser.add_argument("--tol", type=float, default=1e-6, help="Amélioration relative en dessous de laquelle l'incumbent est stable")
+    parser.add_argument("--output", type=Path, default=None, help="CSV du résumé (optionnel)")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    summary = summarize(args.trace_dir or args.result_path / "gurobi_traces", args.tol)
+    print(summary.to_string(index=False))
+
+    for (solver, index, cardinality), group in summary.groupby(["solver", "index", "cardinality"]):
+        quantiles = group["last_improvement"].quantile([0.5, 0.9, 1.0])
+        print(
+            f"{solver} {index} K={cardinality}: last improvement median {quantiles[0.5]:.1f}s, "
+            f"90% {quantiles[0.9]:.1f}s, max {quantiles[1.0]:.1f}s over {len(group)} windows "
+            f"(mean runtime {group['runtime'].mean():.1f}s, mean final gap {group['gap'].mean():.2%})"
+        )
+
+    if args.output is not None:
+        summary.to_csv(args.output, index=False)
+        print(f"Saved summary to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
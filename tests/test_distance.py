@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from prafa.distance import distance_correlation_matrix, fast_distance_correlation_matrix
+
+
+def naive_dcor(x, y):
+    #définition directe (V-statistique biaisée) : matrices de distance doublement centrées
+    def centred(v):
+        a = np.abs(v[:, None] - v[None, :])
+        return a - a.mean(axis=0) - a.mean(axis=1)[:, None] + a.mean()
+
+    A, B = centred(x), centred(y)
+    dcov2, dvar_x, dvar_y = (A * B).mean(), (A * A).mean(), (B * B).mean()
+    if dvar_x <= 0 or dvar_y <= 0:
+        return 0.0
+    return np.sqrt(max(dcov2, 0.0) / np.sqrt(dvar_x * dvar_y))
+
+
+def naive_matrix(returns):
+    n = returns.shape[1]
+    return np.array([[naive_dcor(returns[:, i], returns[:, j]) for j in range(n)] for i in range(n)])
+
+
+@pytest.fixture
+def returns():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(23, 7))
+    X[:, 3] = X[:, 1] ** 2  #dépendance non linéaire
+    X[:, 5] = 0.0  #titre constant : dcor 0
+    X[:5, 6] = X[5:10, 6]  #valeurs répétées (égalités dans les tris)
+    return X
+
+
+def test_blas_engine_matches_naive_dcor(returns):
+    np.testing.assert_allclose(distance_correlation_matrix(returns), naive_matrix(returns), atol=1e-12)
+
+
+def test_blas_engine_tiles_match_one_block(returns):
+    T = returns.shape[0]
+    #budget de deux colonnes par tuile : plusieurs tuiles et le fichier temporaire
+    budget = 2 * 2 * (T * (T + 1) // 2) * 8
+    np.testing.assert_allclose(
+        distance_correlation_matrix(returns, memory_budget=budget), distance_correlation_matrix(returns), atol=1e-14
+    )
+
+
+@pytest.mark.parametrize("tile", [2, 128])
+def test_fast_engine_matches_naive_dcor(returns, tile):
+    np.testing.assert_allclose(fast_distance_correlation_matrix(returns, tile=tile), naive_matrix(returns), atol=1e-12)
+
+
+def test_engines_match_the_dcor_package(returns):
+    dcor = pytest.importorskip("dcor")
+    expected = np.array([
+        [dcor.distance_correlation(returns[:, i], returns[:, j]) for j in range(returns.shape[1])]
+        for i in range(returns.shape[1])
+    ])
+    np.testing.assert_allclose(distance_correlation_matrix(returns), expected, atol=1e-12)
+    np.testing.assert_allclose(fast_distance_correlation_matrix(returns), expected, atol=1e-12)
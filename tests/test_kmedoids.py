@@ -0,0 +1,82 @@
+import itertools
+import warnings
+
+import numpy as np
+import pytest
+
+from prafa.kmedoids import build, faster_pam
+
+
+def distance_matrix(points):
+    return np.linalg.norm(points[:, None] - points[None, :], axis=2)
+
+
+def deviation(D, medoids):
+    return D[list(medoids)].min(axis=0).sum()
+
+
+def brute_force(D, K):
+    return min(itertools.combinations(range(D.shape[0]), K), key=lambda medoids: deviation(D, medoids))
+
+
+def test_faster_pam_single_medoid():
+    rng = np.random.default_rng(0)
+    D = distance_matrix(rng.normal(size=(40, 3)))
+    best = int(np.argmin(D.sum(axis=1)))
+    start = (best + 1) % 40
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        medoids, total, swaps = faster_pam(D, [start])
+
+    assert medoids.tolist() == [best]
+    assert np.isclose(total, D[best].sum())
+    assert swaps == 1
+    assert faster_pam(D, build(D, 1))[0].tolist() == [best]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("K", [2, 3])
+def test_build_adds_the_best_medoid_at_each_step(seed, K):
+    D = distance_matrix(np.random.default_rng(seed).normal(size=(10, 2)))
+    medoids = build(D, K).tolist()
+
+    assert len(set(medoids)) == K
+    for step in range(1, K + 1):
+        prefix = medoids[: step - 1]
+        candidates = [c for c in range(10) if c not in prefix]
+        best = min(deviation(D, prefix + [c]) for c in candidates)
+        assert np.isclose(deviation(D, medoids[:step]), best)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("K", [2, 3, 4])
+def test_faster_pam_reaches_a_swap_local_optimum(seed, K):
+    D = distance_matrix(np.random.default_rng(seed).normal(size=(10, 2)))
+    initial = build(D, K)
+    medoids, total, _ = faster_pam(D, initial)
+
+    assert len(set(medoids.tolist())) == K
+    assert np.isclose(total, deviation(D, medoids))
+    assert total <= deviation(D, initial) + 1e-12
+    for i, x in itertools.product(range(K), range(10)):
+        if x in medoids:
+            continue
+        swapped = medoids.copy()
+        swapped[i] = x
+        assert deviation(D, swapped) >= total - 1e-12
+    assert total >= deviation(D, brute_force(D, K)) - 1e-12
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_faster_pam_finds_the_optimum_of_separated_clusters(seed):
+    rng = np.random.default_rng(seed)
+    centres = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 10.0]])
+    points = np.concatenate([centre + rng.normal(scale=0.5, size=(4, 2)) for centre in centres])
+    D = distance_matrix(points)
+    #départ volontairement mauvais : trois médoïdes dans le meme groupe
+    medoids, total, _ = faster_pam(D, [0, 1, 2])
+
+    optimum = brute_force(D, 3)
+    assert sorted(medoids.tolist()) == sorted(optimum)
+    assert np.isclose(total, deviation(D, optimum))
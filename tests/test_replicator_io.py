@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from prafa.quob import QUOB
+from prafa.replicator_io import read_distance_matrix, write_distance_matrix
+
+
+@pytest.mark.parametrize("fmt", ["text", "binary"])
+def test_distance_matrix_round_trips_as_float32(tmp_path, fmt):
+    D = np.random.default_rng(0).random((6, 6))
+    path = tmp_path / "dist_matrix.d"
+    write_distance_matrix(path, D, fmt)
+    #%.9g (texte) et float32 (binaire) gardent exactement les valeurs float32 lues par ReplicaTOR
+    np.testing.assert_array_equal(read_distance_matrix(path).astype(np.float32), D.astype(np.float32))
+
+
+def test_quob_rejects_binary_with_replicator_before_any_work(tmp_path):
+    with pytest.raises(ValueError, match="binary"):
+        QUOB(np.zeros((5, 3)), np.zeros(5), 2, dist_format='binary', backend='replicator', workdir_root=tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("backend", ["replicator", "numpy"])
+def test_quob_keeps_every_stock_when_n_is_at_most_k(tmp_path, backend):
+    rng = np.random.default_rng(0)
+    returns = rng.normal(size=(40, 3))
+    #aucun solveur ne tourne (le binaire ReplicaTOR est absent ici) et aucun fichier n'est écrit
+    quob = QUOB(returns, returns.mean(axis=1), 5, distance_method='pearson', backend=backend,
+                workdir_root=tmp_path, keep_artifacts=True)
+    weights = quob.get_weights()
+    assert quob.idx == [0, 1, 2]
+    assert list(quob.dist_dir.iterdir()) == []
+    assert weights.min() >= 0 and weights.sum() == pytest.approx(1.0)
@@ -0,0 +1,42 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from prafa.tempering import energy
+from prafa.warm_start import Objective, polish, selection_cost, swap_refine
+
+
+def distance_matrix(seed, n=12):
+    points = np.random.default_rng(seed).normal(size=(n, 2))
+    return np.linalg.norm(points[:, None] - points[None, :], axis=2)
+
+
+def test_quob_objective_is_the_tempering_energy():
+    D = distance_matrix(0)
+    objective = Objective.quob(0.0333, 1.0)
+    for idx in ([0, 3, 7], [1, 2, 4, 11]):
+        assert np.isclose(selection_cost(D, idx, len(idx), objective), energy(D, D.sum(axis=1), idx, 0.0333, 1.0))
+
+
+@pytest.mark.parametrize("objective", [None, Objective.quob(0.0333, 1.0)])
+def test_swap_refine_is_a_local_optimum_of_its_objective(objective):
+    D, K = distance_matrix(1), 4
+    refined = swap_refine(D, [0, 1, 2, 3], K, objective=objective).tolist()
+    cost = selection_cost(D, refined, K, objective)
+    for u, v in itertools.product(refined, set(range(12)) - set(refined)):
+        swapped = [v if i == u else i for i in refined]
+        assert selection_cost(D, swapped, K, objective) >= cost - 1e-12
+
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_polish_never_raises_the_quob_energy(seed):
+    D, K = distance_matrix(seed, n=20), 5
+    rng = np.random.default_rng(seed)
+    for _ in range(10):
+        idx = sorted(rng.choice(20, K, replace=False).tolist())
+        polished = polish(D, idx, K, time_limit=10, objective=Objective.quob(0.0333, 1.0))
+        row_sums = D.sum(axis=1)
+        assert len(set(polished)) == K
+        assert energy(D, row_sums, polished, 0.0333, 1.0) <= energy(D, row_sums, idx, 0.0333, 1.0) + 1e-12
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from prafa.weights import full_replication_weights, project_simplex, simplex_least_squares, tracking_weights
+
+
+def tracking_problem(seed, T, K, rank=None):
+    rng = np.random.default_rng(seed)
+    if rank is None:
+        X = rng.normal(scale=0.01, size=(T, K))
+    else:
+        #K colonnes combinaisons de rank facteurs : G = X^T X est singulière
+        X = rng.normal(scale=0.01, size=(T, rank)) @ rng.random((rank, K))
+    y = X @ rng.dirichlet(np.ones(K)) + rng.normal(scale=0.002, size=T)
+    return X, y
+
+
+def kkt_residual(X, y, w):
+    #sur le simplexe, w est optimal ssi le gradient est minimal (= nu) partout où w_i > 0
+    gradient = X.T @ (X @ w - y)
+    return (gradient[w > 1e-12].max() - gradient.min()) / np.abs(X.T @ y).max()
+
+
+def reference_weights(X, y):
+    #SLSQP avec gradient exact, le solveur que l'ensemble actif a remplacé
+    optimize = pytest.importorskip("scipy.optimize")
+    K = X.shape[1]
+    result = optimize.minimize(
+        lambda w: 0.5 * np.sum((X @ w - y) ** 2), np.full(K, 1 / K), jac=lambda w: X.T @ (X @ w - y),
+        bounds=[(0, 1)] * K, constraints={'type': 'eq', 'fun': lambda w: w.sum() - 1}, method='SLSQP',
+        options={'ftol': 1e-16, 'maxiter': 1000},
+    )
+    return result.x
+
+
+def objective(X, y, w):
+    return 0.5 * np.sum((X @ w - y) ** 2)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("T, K", [(250, 8), (30, 12)])
+def test_tracking_weights_are_feasible_and_kkt_optimal(seed, T, K):
+    X, y = tracking_problem(seed, T, K)
+    w = tracking_weights(X, y)
+    assert w.min() >= 0
+    assert w.sum() == pytest.approx(1.0, abs=1e-12)
+    assert kkt_residual(X, y, w) < 1e-8
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_tracking_weights_match_a_reference_solve(seed):
+    X, y = tracking_problem(seed, 250, 8)
+    w = tracking_weights(X, y)
+    reference = reference_weights(X, y)
+    #G définie positive : minimiseur unique
+    assert objective(X, y, w) <= objective(X, y, reference) + 1e-12
+    np.testing.assert_allclose(w, reference, atol=1e-5)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("T", [400, 60])
+def test_fista_agrees_with_the_active_set(seed, T):
+    #T >= n : matrice de Gram, T < n : LinearOperator X^T (X v)
+    X, y = tracking_problem(seed, T, 100)
+    w = full_replication_weights(X, y)
+    assert w.min() >= 0
+    assert w.sum() == pytest.approx(1.0, abs=1e-9)
+    assert objective(X, y, w) == pytest.approx(objective(X, y, tracking_weights(X, y)), rel=1e-6, abs=1e-12)
+
+
+def test_project_simplex_is_the_euclidean_projection():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        v = rng.normal(size=7)
+        p = project_simplex(v)
+        assert p.min() >= 0 and p.sum() == pytest.approx(1.0)
+        #caractérisation de la projection : (v - p) . (q - p) <= 0 pour tout q du simplexe
+        for q in np.eye(7):
+            assert np.dot(v - p, q - p) <= 1e-12
+
+
+def test_rank_deficient_problem_reaches_kkt_optimality(capsys):
+    X, y = tracking_problem(0, 20, 40, rank=5)
+    w = tracking_weights(X, y)
+    assert w.min() >= 0 and w.sum() == pytest.approx(1.0)
+    #la crete 1e-12 rend les systèmes KKT inversibles sans déplacer l'optimum de façon mesurable
+    assert kkt_residual(X, y, w) < 1e-8
+    assert "KKT" not in capsys.readouterr().out
+
+
+def test_rank_deficient_problem_warns_when_iterations_run_out(capsys):
+    X, y = tracking_problem(0, 20, 40, rank=5)
+    optimum = tracking_weights(X, y)
+    capsys.readouterr()
+    w = simplex_least_squares(X.T @ X, X.T @ y, max_iter=2)
+    assert "without reaching KKT optimality" in capsys.readouterr().out
+    #poids encore admissibles, mais pas optimaux
+    assert w.min() >= 0 and w.sum() == pytest.approx(1.0)
+    assert objective(X, y, w) > objective(X, y, optimum)